@@ -1,8 +1,23 @@
-import os, re, io, csv
-from flask import Flask, render_template, request, redirect, url_for, flash
-from sqlalchemy import create_engine, Column, Integer, String, Numeric, Text, ForeignKey
+import os, re, io, csv, json, gzip, math, time, base64, hashlib, shutil, tempfile, threading, uuid, zipfile
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from collections import OrderedDict, namedtuple
+from decimal import Decimal
+from datetime import datetime, timezone, timedelta
+from contextlib import contextmanager
+from flask import Flask, render_template, stream_template, stream_with_context, send_file, jsonify, request, redirect, url_for, flash, session, make_response, g, has_request_context, before_render_template, template_rendered
+from sqlalchemy import event, create_engine, select, text, column, inspect, case, and_, or_, Column, Integer, String, Numeric, Text, ForeignKey, DateTime, func
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.pool import QueuePool, StaticPool
 from sqlalchemy.orm import sessionmaker, declarative_base, relationship
 
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
 # --- App ---
 app = Flask(__name__)
 app.secret_key = os.environ.get("FLASK_SECRET", "change-this-secret")
@@ -16,18 +31,243 @@ db_url = os.environ.get("DATABASE_URL", "").replace("postgres://", "postgresql+p
 # Normalize to psycopg v3 driver if plain postgresql:// is provided
 if db_url.startswith("postgresql://"):
     db_url = db_url.replace("postgresql://", "postgresql+psycopg://", 1)
+if not db_url:
+    db_url = "sqlite:///" + os.path.join(os.path.dirname(os.path.abspath(__file__)), "gym.db")
+
+PG_SSLMODE = os.environ.get("PG_SSLMODE", "require")  # Render Postgres usually requires SSL
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_MB = int(os.environ.get("SQLITE_MMAP_MB", "256"))
+
+# Pool sized from the gunicorn config (gunicorn.conf.py reads the same variables): a request
+# holds exactly one connection, so each worker needs one per thread plus a little headroom,
+# plus one per background ingest thread.
+# DB_MAX_CONNECTIONS, when set, is the server-side limit shared by all workers.
+def pool_settings():
+    workers = max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+    threads = max(1, int(os.environ.get("GUNICORN_THREADS", "1")))
+    pool_size, max_overflow = threads, 2 + INGEST_WORKERS
+    max_conn = int(os.environ.get("DB_MAX_CONNECTIONS", "0"))
+    if max_conn:
+        per_worker = max(1, max_conn // workers)
+        pool_size = min(pool_size, per_worker)
+        max_overflow = min(max_overflow, per_worker - pool_size)
+    return pool_size, max_overflow
+
+# Created on first use, so importing the app (gunicorn worker boot) opens no connections.
+_engine = None
+_engine_lock = threading.Lock()
+_session_factory = sessionmaker()
+
+def _sqlite_pragmas(dbapi_conn, record):
+    # WAL lets readers run while an upload writes; NORMAL is durable across app crashes in WAL mode
+    # (only an OS crash can lose the last commits); mmap serves reads straight from the page cache.
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute(f"PRAGMA mmap_size={SQLITE_MMAP_MB * 1024 * 1024}")
+    cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cur.close()
+
+def make_engine(url):
+    if url.startswith("sqlite"):
+        if url in ("sqlite://", "sqlite:///:memory:"):
+            # one shared connection, or every checkout would see its own empty database
+            engine = create_engine(url, poolclass=StaticPool, connect_args={"check_same_thread": False})
+        else:
+            # same sizing as Postgres; local connections never go stale, so no pre-ping or recycle
+            pool_size, max_overflow = pool_settings()
+            engine = create_engine(
+                url,
+                poolclass=QueuePool,
+                pool_size=pool_size,
+                max_overflow=max_overflow,
+                connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+            )
+            event.listen(engine, "connect", _sqlite_pragmas)
+        return engine
+    pool_size, max_overflow = pool_settings()
+    return create_engine(
+        url,
+        pool_pre_ping=True,  # once per request: the connection is kept until teardown
+        pool_recycle=1800,  # recycle stale connections
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        connect_args={"sslmode": PG_SSLMODE} if url.startswith("postgresql") else {},
+    )
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = make_engine(db_url)
+                _session_factory.configure(bind=_engine)
+                event.listen(_engine, "before_cursor_execute", _before_cursor_execute)
+                event.listen(_engine, "after_cursor_execute", _after_cursor_execute)
+    return _engine
+
+def SessionLocal():
+    get_engine()
+    return _session_factory()
+
+def get_db():
+    # One Session on one pooled connection for the whole request, closed in close_db().
+    # GET/HEAD only read, so they skip autoflush.
+    if "db" not in g:
+        engine = get_engine()
+        started = time.perf_counter()
+        conn = engine.connect()
+        request_stats()["pool_wait"] += time.perf_counter() - started
+        g.db_conn = conn
+        g.db = _session_factory(bind=conn, autoflush=request.method not in ("GET", "HEAD"))
+    return g.db
+
+@contextmanager
+def session_scope():
+    # The request session inside a request, a private one elsewhere (CLI, background work).
+    if has_request_context():
+        yield get_db()
+        return
+    s = SessionLocal()
+    try:
+        yield s
+    finally:
+        s.close()
+
+@app.teardown_appcontext
+def close_db(exc):
+    s = g.pop("db", None)
+    conn = g.pop("db_conn", None)
+    if s is not None:
+        s.close()
+    if conn is not None:
+        conn.close()
+
+# --- Instrumentation ---
+# Per-request counters (queries, SQL time, template render time, pool checkout wait, response
+# size) collected in g and summed per endpoint into `metrics`, served by /metrics in the
+# Prometheus text format. Counters are per worker process; Prometheus sums the scrapes.
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", "1000"))  # 0 disables the log line
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}  # (endpoint, method, status) -> count
+        self.sums = {}  # endpoint -> {"seconds", "queries", "sql", "render", "pool_wait", "bytes"}
+        self.duration = {}  # endpoint -> bucket counts (+Inf last)
+        self.queries = {}
+
+    def observe(self, endpoint, method, status, seconds, stats, size):
+        with self._lock:
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            sums = self.sums.setdefault(endpoint, dict.fromkeys(
+                ("seconds", "queries", "sql", "render", "pool_wait", "bytes"), 0))
+            sums["seconds"] += seconds
+            sums["bytes"] += size or 0
+            for k in ("queries", "sql", "render", "pool_wait"):
+                sums[k] += stats[k]
+            for hist, buckets, value in ((self.duration, DURATION_BUCKETS, seconds),
+                                         (self.queries, QUERY_BUCKETS, stats["queries"])):
+                counts = hist.setdefault(endpoint, [0] * (len(buckets) + 1))
+                for i, bound in enumerate(buckets):
+                    if value <= bound:
+                        counts[i] += 1
+                counts[-1] += 1
+
+    def render(self, gauges=()):
+        out = []
+        with self._lock:
+            out += ["# TYPE gym_requests_total counter"]
+            out += ['gym_requests_total{endpoint="%s",method="%s",status="%s"} %d' % (e, m, st, n)
+                    for (e, m, st), n in sorted(self.requests.items())]
+            for name, key, doc in [
+                ("gym_request_seconds_total", "seconds", "wall time spent in requests"),
+                ("gym_sql_queries_total", "queries", "SQL statements executed"),
+                ("gym_sql_seconds_total", "sql", "time spent executing SQL"),
+                ("gym_render_seconds_total", "render", "time spent rendering templates"),
+                ("gym_pool_wait_seconds_total", "pool_wait", "time spent waiting for a pooled connection"),
+                ("gym_response_bytes_total", "bytes", "response body bytes (streamed bodies not counted)"),
+            ]:
+                out += [f"# HELP {name} {doc}", f"# TYPE {name} counter"]
+                out += ['%s{endpoint="%s"} %s' % (name, e, _num(sums[key])) for e, sums in sorted(self.sums.items())]
+            for name, hist, buckets in [("gym_request_duration_seconds", self.duration, DURATION_BUCKETS),
+                                        ("gym_request_queries", self.queries, QUERY_BUCKETS)]:
+                out += [f"# TYPE {name} histogram"]
+                sum_key = "seconds" if hist is self.duration else "queries"
+                for e, counts in sorted(hist.items()):
+                    out += ['%s_bucket{endpoint="%s",le="%s"} %d' % (name, e, b, c) for b, c in zip(buckets, counts)]
+                    out += ['%s_bucket{endpoint="%s",le="+Inf"} %d' % (name, e, counts[-1]),
+                            '%s_sum{endpoint="%s"} %s' % (name, e, _num(self.sums[e][sum_key])),
+                            '%s_count{endpoint="%s"} %d' % (name, e, counts[-1])]
+        for name, value in gauges:
+            out += [f"# TYPE {name} gauge", f"{name} {_num(value)}"]
+        return "\n".join(out) + "\n"
+
+def _num(v):
+    return "%d" % v if isinstance(v, int) else "%.6f" % v
 
-connect_args = {"sslmode": "require"}  # Render Postgres usually requires SSL
+metrics = Metrics()
 
-engine = create_engine(
-    db_url,
-    pool_pre_ping=True,
-    pool_recycle=1800,  # recycle stale connections
-    pool_size=5,
-    max_overflow=10,
-    connect_args=connect_args
-)
-SessionLocal = sessionmaker(bind=engine)
+def request_stats():
+    # counters of the current request; a throwaway dict outside requests (CLI, ingest threads)
+    if not has_request_context():
+        return dict.fromkeys(("queries", "sql", "render", "pool_wait"), 0)
+    if "stats" not in g:
+        g.stats = dict.fromkeys(("queries", "sql", "render", "pool_wait"), 0)
+    return g.stats
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    if has_request_context():
+        stats = request_stats()
+        stats["queries"] += 1
+        stats["sql"] += elapsed
+
+@before_render_template.connect_via(app)
+def _render_started(sender, template, context, **extra):
+    g.setdefault("render_start", []).append(time.perf_counter())
+
+@template_rendered.connect_via(app)
+def _render_finished(sender, template, context, **extra):
+    starts = g.get("render_start")
+    if starts:
+        request_stats()["render"] += time.perf_counter() - starts.pop()
+
+@app.before_request
+def _start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def _note_response(resp):
+    g.response_size = None if resp.is_streamed else resp.calculate_content_length()
+    g.response_status = resp.status_code
+    return resp
+
+@app.teardown_request
+def _record_request(exc):
+    # Runs after a streamed body has been sent, so its queries are counted too.
+    started = g.pop("request_start", None)
+    if started is None:
+        return
+    seconds = time.perf_counter() - started
+    stats = request_stats()
+    endpoint = request.endpoint or "none"
+    size = g.get("response_size")
+    status = 500 if exc is not None else g.get("response_status", 500)
+    metrics.observe(endpoint, request.method, status, seconds, stats, size)
+    if SLOW_REQUEST_MS and seconds * 1000 >= SLOW_REQUEST_MS:
+        app.logger.warning("slow request %s %s endpoint=%s status=%s %.0fms queries=%d sql=%.0fms "
+                           "render=%.0fms pool_wait=%.0fms bytes=%s",
+                           request.method, request.full_path.rstrip("?"), endpoint, status, seconds * 1000,
+                           stats["queries"], stats["sql"] * 1000, stats["render"] * 1000,
+                           stats["pool_wait"] * 1000, size if size is not None else "-")
 
 Base = declarative_base()
 
@@ -45,6 +285,7 @@ class Category(Base):
     name = Column(String(300), nullable=False)
 
 class Ranking(Base):
+    # read-path indexes live in MIGRATIONS (they differ between Postgres and SQLite)
     __tablename__ = "rankings"
     id = Column(Integer, primary_key=True)
     category_id = Column(Integer, ForeignKey("categories.id"), nullable=False)
@@ -58,47 +299,504 @@ class Ranking(Base):
     chair_penalty = Column(Numeric(8,3), nullable=True)
     diff_penalty = Column(Numeric(8,3), nullable=True)
     total = Column(Numeric(8,3), nullable=True)
+    # competition ranking within the category (1,1,3,...) and 1/2/3 for medals; set by rank_rows()
+    rank = Column(Integer, nullable=True)
+    medal = Column(Integer, nullable=True)
     category = relationship("Category")
 
-Base.metadata.create_all(engine)
+class RankingStaging(Base):
+    # Rows of an in-flight "replace" upload, keyed by batch; see replace_category_rows()
+    __tablename__ = "rankings_staging"
+    id = Column(Integer, primary_key=True)
+    batch = Column(String(32), nullable=False, index=True)
+    category_id = Column(Integer, nullable=False)
+    position = Column(String(50))
+    competitor = Column(String(200))
+    club = Column(String(200))
+    execution = Column(Numeric(8,3), nullable=True)
+    artistry = Column(Numeric(8,3), nullable=True)
+    difficulty = Column(Numeric(8,3), nullable=True)
+    line_penalty = Column(Numeric(8,3), nullable=True)
+    chair_penalty = Column(Numeric(8,3), nullable=True)
+    diff_penalty = Column(Numeric(8,3), nullable=True)
+    total = Column(Numeric(8,3), nullable=True)
+    rank = Column(Integer, nullable=True)
+    medal = Column(Integer, nullable=True)
+
+class DataVersion(Base):
+    # Bumped on every write that changes what a public page shows (see bump_versions)
+    __tablename__ = "data_versions"
+    scope = Column(String(250), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), nullable=True)
+
+class IngestJob(Base):
+    # One upload (CSV, XLSX or ZIP of them) processed by the background ingest pool
+    __tablename__ = "ingest_jobs"
+    id = Column(String(32), primary_key=True)
+    status = Column(String(20), nullable=False)  # queued / running / done / failed
+    filename = Column(String(300), nullable=False)
+    category_slug = Column(String(200), nullable=True)  # None for ZIP uploads
+    mode = Column(String(20), nullable=False)
+    files_total = Column(Integer, nullable=False, default=0)
+    files_done = Column(Integer, nullable=False, default=0)
+    rows_parsed = Column(Integer, nullable=False, default=0)
+    rows_inserted = Column(Integer, nullable=False, default=0)
+    errors = Column(Text, nullable=False, default="[]")  # JSON list of {"file", "message"}
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False)
+
+class CategoryStats(Base):
+    # Aggregates of one category's rankings, rebuilt by refresh_stats() whenever its rows change
+    __tablename__ = "category_stats"
+    category_id = Column(Integer, ForeignKey("categories.id"), primary_key=True)
+    entries = Column(Integer, nullable=False, default=0)
+    scored = Column(Integer, nullable=False, default=0)  # rows with a total
+    total_sum = Column(Numeric(14,3), nullable=True)
+    total_sq_sum = Column(Numeric(20,6), nullable=True)
+    min_total = Column(Numeric(8,3), nullable=True)
+    max_total = Column(Numeric(8,3), nullable=True)
+
+class ClubStats(Base):
+    # Entries and medals of one club in one category; summed across categories for the medal table
+    __tablename__ = "club_stats"
+    category_id = Column(Integer, ForeignKey("categories.id"), primary_key=True)
+    club = Column(String(200), primary_key=True)
+    entries = Column(Integer, nullable=False, default=0)
+    gold = Column(Integer, nullable=False, default=0)
+    silver = Column(Integer, nullable=False, default=0)
+    bronze = Column(Integer, nullable=False, default=0)
+    best_rank = Column(Integer, nullable=True)
+
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+    version = Column(Integer, primary_key=True)
+    name = Column(String(200), nullable=False)
+    applied_at = Column(DateTime(timezone=True), nullable=False)
+
+# --- Schema migrations ---
+# Append-only. Each entry: (version, name, fn(conn), needs_autocommit). Migrations that
+# use CREATE INDEX CONCURRENTLY cannot run inside a transaction, hence needs_autocommit.
+def create_index_concurrently(conn, name, definition):
+    # An interrupted CREATE INDEX CONCURRENTLY leaves an INVALID index that IF NOT EXISTS would
+    # then skip on every retry: drop it first so it gets rebuilt.
+    invalid = conn.execute(text(
+        "SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+        "WHERE c.relname = :name AND pg_table_is_visible(c.oid) AND NOT i.indisvalid"), {"name": name}).first()
+    if invalid:
+        conn.exec_driver_sql(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+    conn.exec_driver_sql(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} {definition}")
+
+def _m001_baseline(conn):
+    Base.metadata.create_all(conn)
+
+def _m002_read_path_indexes(conn):
+    if conn.dialect.name == "postgresql":
+        for name, definition in [
+            # home(): top N per category by total; INCLUDE lets Postgres answer it from the index
+            ("ix_rankings_category_total",
+             "ON rankings (category_id, total DESC NULLS LAST, id) "
+             "INCLUDE (position, competitor, club, execution, artistry, difficulty, "
+             "line_penalty, chair_penalty, diff_penalty)"),
+            # category_page(): all rows of one category in upload order
+            ("ix_rankings_category_id", "ON rankings (category_id, id)"),
+            ("ix_categories_slug_cover", "ON categories (slug) INCLUDE (id, name)"),
+            ("ix_categories_name", "ON categories (name, slug)"),
+        ]:
+            create_index_concurrently(conn, name, definition)
+        return
+    for stmt in [
+        "CREATE INDEX IF NOT EXISTS ix_rankings_category_total ON rankings (category_id, total DESC, id)",
+        "CREATE INDEX IF NOT EXISTS ix_rankings_category_id ON rankings (category_id, id)",
+        "CREATE INDEX IF NOT EXISTS ix_categories_slug_cover ON categories (slug, id, name)",
+        "CREATE INDEX IF NOT EXISTS ix_categories_name ON categories (name, slug)",
+    ]:
+        conn.exec_driver_sql(stmt)
+
+def _m003_rank_columns(conn):
+    for table in ("rankings", "rankings_staging"):
+        have = {c["name"] for c in inspect(conn).get_columns(table)}
+        for col in ("rank", "medal"):
+            if col not in have:
+                conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {col} INTEGER")
+    conn.execute(rank_rows(Ranking.__table__))
+
+def _m004_rank_read_path_index(conn):
+    # Reads now walk (category_id, rank, id); the total/id orderings are no longer used.
+    if conn.dialect.name == "postgresql":
+        create_index_concurrently(
+            conn, "ix_rankings_category_rank",
+            "ON rankings (category_id, rank, id) "
+            "INCLUDE (medal, position, competitor, club, execution, artistry, difficulty, "
+            "line_penalty, chair_penalty, diff_penalty, total)")
+        stmts = [
+            "DROP INDEX CONCURRENTLY IF EXISTS ix_rankings_category_total",
+            "DROP INDEX CONCURRENTLY IF EXISTS ix_rankings_category_id",
+        ]
+    else:
+        stmts = [
+            "CREATE INDEX IF NOT EXISTS ix_rankings_category_rank ON rankings (category_id, rank, id)",
+            "DROP INDEX IF EXISTS ix_rankings_category_total",
+            "DROP INDEX IF EXISTS ix_rankings_category_id",
+        ]
+    for stmt in stmts:
+        conn.exec_driver_sql(stmt)
+
+def _m005_ingest_jobs(conn):
+    IngestJob.__table__.create(conn, checkfirst=True)
+
+def _m006_search_index(conn):
+    # Postgres: trigram GIN indexes (prefix, substring and fuzzy matches).
+    # SQLite: an FTS5 index over competitor/club kept in sync by triggers.
+    # Without pg_trgm / FTS5 the search falls back to LIKE, which does not fold diacritics.
+    if conn.dialect.name == "postgresql":
+        try:
+            conn.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        except Exception as e:
+            app.logger.warning("pg_trgm unavailable, search will use ILIKE: %s", e)
+            return
+        for col in ("competitor", "club"):
+            create_index_concurrently(conn, f"ix_rankings_{col}_trgm", f"ON rankings USING gin ({col} gin_trgm_ops)")
+    elif conn.dialect.name == "sqlite":
+        try:
+            conn.exec_driver_sql(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS rankings_fts USING fts5("
+                "competitor, club, content='rankings', content_rowid='id', "
+                "tokenize='unicode61 remove_diacritics 2')")
+        except Exception as e:
+            app.logger.warning("FTS5 unavailable, search will use LIKE: %s", e)
+            return
+        for stmt in [
+            "CREATE TRIGGER IF NOT EXISTS rankings_fts_ai AFTER INSERT ON rankings BEGIN "
+            "INSERT INTO rankings_fts(rowid, competitor, club) VALUES (new.id, new.competitor, new.club); END",
+            "CREATE TRIGGER IF NOT EXISTS rankings_fts_ad AFTER DELETE ON rankings BEGIN "
+            "INSERT INTO rankings_fts(rankings_fts, rowid, competitor, club) "
+            "VALUES ('delete', old.id, old.competitor, old.club); END",
+            "CREATE TRIGGER IF NOT EXISTS rankings_fts_au AFTER UPDATE OF competitor, club ON rankings BEGIN "
+            "INSERT INTO rankings_fts(rankings_fts, rowid, competitor, club) "
+            "VALUES ('delete', old.id, old.competitor, old.club); "
+            "INSERT INTO rankings_fts(rowid, competitor, club) VALUES (new.id, new.competitor, new.club); END",
+            "INSERT INTO rankings_fts(rankings_fts) VALUES ('rebuild')",
+        ]:
+            conn.exec_driver_sql(stmt)
+
+def _m007_stats_tables(conn):
+    CategoryStats.__table__.create(conn, checkfirst=True)
+    ClubStats.__table__.create(conn, checkfirst=True)
+    for stmt in stats_rows():
+        conn.execute(stmt)
+
+def _m008_search_unaccent(conn):
+    # Postgres: fold diacritics like the SQLite FTS5 index does ("stef" finds "Ștefănescu").
+    # unaccent() is only STABLE, so index an IMMUTABLE wrapper pinned to its dictionary.
+    if conn.dialect.name != "postgresql":
+        return
+    if not conn.exec_driver_sql("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'").first():
+        return
+    try:
+        conn.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS unaccent")
+    except Exception as e:
+        app.logger.warning("unaccent unavailable, search will not fold diacritics: %s", e)
+        return
+    schema = conn.exec_driver_sql(
+        "SELECT n.nspname FROM pg_extension e JOIN pg_namespace n ON n.oid = e.extnamespace "
+        "WHERE e.extname = 'unaccent'").scalar()
+    conn.exec_driver_sql(
+        "CREATE OR REPLACE FUNCTION gym_unaccent(text) RETURNS text "
+        "LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT AS "
+        f"$$ SELECT {schema}.unaccent('{schema}.unaccent'::regdictionary, $1) $$")
+    for col in ("competitor", "club"):
+        create_index_concurrently(conn, f"ix_rankings_{col}_unaccent_trgm",
+                                  f"ON rankings USING gin (gym_unaccent({col}) gin_trgm_ops)")
+        conn.exec_driver_sql(f"DROP INDEX CONCURRENTLY IF EXISTS ix_rankings_{col}_trgm")
+
+MIGRATIONS = [
+    (1, "baseline tables", _m001_baseline, False),
+    (2, "read-path indexes", _m002_read_path_indexes, True),
+    (3, "rank and medal columns", _m003_rank_columns, False),
+    (4, "rank read-path index", _m004_rank_read_path_index, True),
+    (5, "ingest jobs", _m005_ingest_jobs, False),
+    (6, "competitor/club search index", _m006_search_index, True),
+    (7, "category and club stats", _m007_stats_tables, False),
+    (8, "diacritic-insensitive search on Postgres", _m008_search_unaccent, True),
+]
+
+MIGRATION_LOCK_ID = 7214001  # pg_advisory_lock key, any constant unique to this app
+
+def migrate(engine):
+    # Safe to run from several processes at once: Postgres serializes them on an advisory lock.
+    applied = []
+    with engine.connect() as lock_conn:
+        if engine.dialect.name == "postgresql":
+            lock_conn.exec_driver_sql(f"SELECT pg_advisory_lock({MIGRATION_LOCK_ID})")
+            lock_conn.commit()
+        try:
+            SchemaMigration.__table__.create(lock_conn, checkfirst=True)
+            lock_conn.commit()
+            done = set(lock_conn.execute(select(SchemaMigration.version)).scalars())
+            lock_conn.commit()
+            for version, name, fn, needs_autocommit in MIGRATIONS:
+                if version in done:
+                    continue
+                if needs_autocommit:
+                    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                        fn(conn)
+                    with engine.begin() as conn:
+                        conn.execute(SchemaMigration.__table__.insert().values(
+                            version=version, name=name, applied_at=datetime.now(timezone.utc)))
+                else:
+                    with engine.begin() as conn:
+                        fn(conn)
+                        conn.execute(SchemaMigration.__table__.insert().values(
+                            version=version, name=name, applied_at=datetime.now(timezone.utc)))
+                applied.append(version)
+        finally:
+            if engine.dialect.name == "postgresql":
+                lock_conn.exec_driver_sql(f"SELECT pg_advisory_unlock({MIGRATION_LOCK_ID})")
+                lock_conn.commit()
+    return applied
 
 # --- Utils ---
 def slugify(text:str)->str:
     return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-")
 
-def to_num(v):
-    try:
-        if v is None or v == "":
-            return None
-        return float(str(v).replace(",", "."))
-    except:
-        return None
+# --- Read models ---
+# Public pages render these tuples straight from Core rows: no ORM identity map, and scores
+# are formatted once here instead of with '%.3f'|format in every template cell.
+CategoryView = namedtuple("CategoryView", "id slug name")
+CategorySection = namedtuple("CategorySection", "slug name rows")
+RankingView = namedtuple("RankingView", "id category_id rank medal position competitor club execution "
+                                        "artistry difficulty line_penalty chair_penalty diff_penalty total")
+
+def fmt_score(v):
+    return "%.3f" % v if v is not None else ""
+
+def ranking_view(row):
+    return RankingView(*row[:7], *[fmt_score(v) for v in row[7:]])
+
+def ranking_view_select():
+    return select(*[Ranking.__table__.c[f] for f in RankingView._fields])
+
+def load_categories(s):
+    t = Category.__table__
+    return [CategoryView(*r) for r in s.execute(select(t.c.id, t.c.slug, t.c.name).order_by(t.c.name))]
+
+def find_category(s, slug):
+    t = Category.__table__
+    row = s.execute(select(t.c.id, t.c.slug, t.c.name).where(t.c.slug == slug)).first()
+    return CategoryView(*row) if row else None
+
+def rank_order(t):
+    return (t.c.rank, t.c.id)
+
+def rank_rows(t, where=None):
+    # One UPDATE ... FROM: competition ranking by total (ties share a rank, the next rank skips),
+    # empty totals last; medal = rank for the top three scored places.
+    rk = func.rank().over(partition_by=t.c.category_id,
+                          order_by=t.c.total.desc().nullslast()).label("rk")
+    ranked = select(t.c.id, rk)
+    if where is not None:
+        ranked = ranked.where(where)
+    ranked = ranked.subquery()
+    return (t.update()
+              .where(t.c.id == ranked.c.id)
+              .values(rank=ranked.c.rk,
+                      medal=case((and_(ranked.c.rk <= 3, t.c.total.isnot(None)), ranked.c.rk), else_=None)))
+
+def recompute_ranks(s, category_id):
+    t = Ranking.__table__
+    s.execute(rank_rows(t, t.c.category_id == category_id))
+
+def top_rankings(s, category_ids, limit):
+    # Top `limit` rows of every category in one windowed query over the (category_id, rank, id)
+    # index (Postgres & SQLite >= 3.30)
+    t = Ranking.__table__
+    rn = func.row_number().over(
+        partition_by=t.c.category_id,
+        order_by=rank_order(t),
+    ).label("rn")
+    sub = (ranking_view_select().add_columns(rn)
+             .where(t.c.category_id.in_(category_ids))
+             .subquery())
+    stmt = (select(*[sub.c[f] for f in RankingView._fields])
+              .where(sub.c.rn <= limit)
+              .order_by(sub.c.category_id, sub.c.rn))
+    return [ranking_view(r) for r in s.execute(stmt)]
+
+# --- Materialized stats ---
+# category_stats / club_stats are rebuilt per category in the same transaction as the write
+# (upload, delete), so public pages read a handful of pre-aggregated rows instead of rankings.
+CategoryStatsView = namedtuple("CategoryStatsView", "id slug name entries scored mean min max spread stddev")
+ClubStanding = namedtuple("ClubStanding", "club gold silver bronze medals entries categories best_rank")
+
+def stats_rows(category_id=None):
+    # DELETE + INSERT ... SELECT statements that rebuild the stats of one category (or all)
+    r, cs, cl = Ranking.__table__, CategoryStats.__table__, ClubStats.__table__
+
+    def where(stmt, t):
+        return stmt if category_id is None else stmt.where(t.c.category_id == category_id)
+
+    cat_agg = where(select(r.c.category_id, func.count(), func.count(r.c.total), func.sum(r.c.total),
+                           func.sum(r.c.total * r.c.total), func.min(r.c.total), func.max(r.c.total)), r)
+    club = func.trim(r.c.club)
+    club_agg = where(select(r.c.category_id, club, func.count(),
+                            func.sum(case((r.c.medal == 1, 1), else_=0)),
+                            func.sum(case((r.c.medal == 2, 1), else_=0)),
+                            func.sum(case((r.c.medal == 3, 1), else_=0)),
+                            func.min(r.c.rank))
+                       .where(club != ""), r)
+    return [
+        where(cs.delete(), cs),
+        where(cl.delete(), cl),
+        cs.insert().from_select(["category_id", "entries", "scored", "total_sum", "total_sq_sum",
+                                 "min_total", "max_total"],
+                                cat_agg.group_by(r.c.category_id)),
+        cl.insert().from_select(["category_id", "club", "entries", "gold", "silver", "bronze", "best_rank"],
+                                club_agg.group_by(r.c.category_id, club)),
+    ]
+
+def refresh_stats(s, category_id=None):
+    for stmt in stats_rows(category_id):
+        s.execute(stmt)
+
+def category_stats_view(cat_id, slug, name, entries, scored, total_sum, sq_sum, lo, hi):
+    mean = stddev = spread = None
+    if scored:
+        mean = float(total_sum) / scored
+        stddev = math.sqrt(max(float(sq_sum) / scored - mean * mean, 0.0))
+        spread = float(hi) - float(lo)
+    return CategoryStatsView(cat_id, slug, name, entries or 0, scored or 0, mean,
+                             float(lo) if lo is not None else None,
+                             float(hi) if hi is not None else None, spread, stddev)
+
+def load_category_stats(s):
+    # every category (by name) with its stats; categories without rows have entries == 0
+    c, cs = Category.__table__, CategoryStats.__table__
+    stmt = (select(c.c.id, c.c.slug, c.c.name, cs.c.entries, cs.c.scored, cs.c.total_sum,
+                   cs.c.total_sq_sum, cs.c.min_total, cs.c.max_total)
+              .select_from(c.outerjoin(cs, cs.c.category_id == c.c.id))
+              .order_by(c.c.name))
+    return [category_stats_view(*row) for row in s.execute(stmt)]
+
+def club_standings(s):
+    # medal table: gold, then silver, then bronze, then number of entries
+    cl = ClubStats.__table__
+    gold, silver, bronze = func.sum(cl.c.gold), func.sum(cl.c.silver), func.sum(cl.c.bronze)
+    entries = func.sum(cl.c.entries)
+    stmt = (select(cl.c.club, gold, silver, bronze, entries, func.count(), func.min(cl.c.best_rank))
+              .group_by(cl.c.club)
+              .order_by(gold.desc(), silver.desc(), bronze.desc(), entries.desc(), cl.c.club))
+    return [ClubStanding(club, g, sv, b, g + sv + b, n, cats, best)
+            for club, g, sv, b, n, cats, best in s.execute(stmt)]
+
+SETTINGS_DEFAULTS = {
+    "title": "National Gymnastics Rankings – Romania",
+    "subtitle": "Official RENC",
+    "event_date": "",
+    "location": "",
+}
+
+class SettingsStore:
+    # Per-worker copy of the settings table. Writes go through set_many() and bump the "site"
+    # data version; other workers notice via note_version() (page renders) or a TTL re-check.
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._data = None
+        self._version = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._data is not None and time.monotonic() - self._checked < self.ttl:
+                return self._data
+        with session_scope() as s:
+            version = read_versions(s, [SITE_SCOPE])[0][0]
+            with self._lock:
+                if self._data is not None and version == self._version:
+                    self._checked = time.monotonic()
+                    return self._data
+            data = dict(SETTINGS_DEFAULTS)
+            data.update({k: v for k, v in s.query(Setting.key, Setting.value)})
+        with self._lock:
+            self._data, self._version, self._checked = data, version, time.monotonic()
+        return data
+
+    def note_version(self, version):
+        with self._lock:
+            if version != self._version:
+                self._data = None
+
+    def set_many(self, values):
+        with session_scope() as s:
+            existing = {r.key: r for r in s.query(Setting).filter(Setting.key.in_(list(values)))}
+            for key, value in values.items():
+                if key in existing:
+                    existing[key].value = value
+                else:
+                    s.add(Setting(key=key, value=value))
+            site_changed(s)
+            version = read_versions(s, [SITE_SCOPE])[0][0]
+            s.commit()
+        with self._lock:
+            if self._data is not None:
+                data = dict(self._data)
+                data.update(values)
+                self._data, self._version, self._checked = data, version, time.monotonic()
+
+settings_store = SettingsStore(float(os.environ.get("SETTINGS_TTL", "30")))
 
 def get_settings():
-    s = SessionLocal()
-    out = {}
-    try:
-        for row in s.query(Setting).all():
-            out[row.key] = row.value
-    finally:
-        s.close()
-    out.setdefault("title", "National Gymnastics Rankings – Romania")
-    out.setdefault("subtitle", "Official RENC")
-    out.setdefault("event_date", "")
-    out.setdefault("location", "")
-    return out
+    return dict(settings_store.get())
+
+def set_settings(values):
+    settings_store.set_many(values)
 
 def set_setting(key, value):
-    s = SessionLocal()
-    try:
-        rec = s.query(Setting).filter_by(key=key).first()
-        if rec:
-            rec.value = value
-        else:
-            s.add(Setting(key=key, value=value))
-        s.commit()
-    finally:
-        s.close()
+    set_settings({key: value})
+
+# --- Data versions ---
+# "site": settings + category list (header, dropdown), "home": any ranking data,
+# "cat:<slug>": rows of one category.
+SITE_SCOPE = "site"
+HOME_SCOPE = "home"
+
+def cat_scope(slug):
+    return "cat:" + slug
+
+def bump_versions(s, *scopes):
+    # Runs inside the caller's transaction; the caller commits. An upsert, so two writers
+    # creating the same scope at once (parallel ZIP members) don't hit a unique violation.
+    now = datetime.now(timezone.utc)
+    t = DataVersion.__table__
+    upsert = {"postgresql": pg_insert, "sqlite": sqlite_insert}.get(s.get_bind().dialect.name)
+    for scope in sorted(set(scopes)):  # fixed order: concurrent bumps can't deadlock
+        if upsert is not None:
+            s.execute(upsert(t).values(scope=scope, version=1, updated_at=now)
+                      .on_conflict_do_update(index_elements=[t.c.scope],
+                                             set_={"version": t.c.version + 1, "updated_at": now}))
+            continue
+        n = (s.query(DataVersion).filter_by(scope=scope)
+               .update({DataVersion.version: DataVersion.version + 1, DataVersion.updated_at: now},
+                       synchronize_session=False))
+        if not n:
+            s.add(DataVersion(scope=scope, version=1, updated_at=now))
+
+def data_changed(s, *slugs):
+    bump_versions(s, HOME_SCOPE, *[cat_scope(sl) for sl in slugs])
+
+def site_changed(s):
+    bump_versions(s, SITE_SCOPE)
+
+def read_versions(s, scopes):
+    # -> (version tuple, last modified) for the given scopes
+    found = {sc: (v, ts) for sc, v, ts in
+             s.query(DataVersion.scope, DataVersion.version, DataVersion.updated_at)
+              .filter(DataVersion.scope.in_(scopes))}
+    versions = tuple(found.get(sc, (0, None))[0] for sc in scopes)
+    stamps = [ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)  # SQLite drops the tz
+              for _, ts in found.values() if ts is not None]
+    return versions, (max(stamps) if stamps else None)
 
 # --- Seed default categories & demo rows (only if DB new) ---
 DEFAULT_CATS = [
@@ -125,6 +823,8 @@ DEFAULT_CATS = [
     "AEROBIC DANCE - JUNIORS"
 ]
 
+HOME_TOP_N = 10
+
 REQUIRED_HEADERS = [
     "POSITION","COMPETITOR","CLUB","EXECUTION","ARTISTRY",
     "DIFFICULTY","LINE PENALTY","CHAIR PENALTY","DIFF PENALTY","TOTAL"
@@ -134,11 +834,11 @@ REQUIRED_HEADERS = [
 def seed_if_empty():
     s = SessionLocal()
     try:
-        if s.query(Category).count() == 0:
+        if s.query(Category.id).first() is None:
             for name in DEFAULT_CATS:
                 s.add(Category(slug=slugify(name), name=name))
-            s.commit()
-        if s.query(Ranking).count() == 0:
+            s.flush()
+        if s.query(Ranking.id).first() is None:
             cm = s.query(Category).filter_by(slug=slugify("Individual Men – Senior")).first()
             cw = s.query(Category).filter_by(slug=slugify("Individual Women – Senior")).first()
             if cm:
@@ -147,14 +847,999 @@ def seed_if_empty():
                 s.add(Ranking(category_id=cm.id, position="3", competitor="Andrei Georgescu", club="CSM Cluj", total=14.300))
             if cw:
                 s.add(Ranking(category_id=cw.id, position="1", competitor="Simona Ionescu", club="Dinamo", total=14.800))
-            s.commit()
-        if not s.query(Setting).filter_by(key="title").first():
-            set_setting("title", "National Gymnastics Rankings – Romania")
-            set_setting("subtitle", "Official RENC")
+            s.flush()
+            s.execute(rank_rows(Ranking.__table__))
+            refresh_stats(s)
+        if s.query(Setting.id).filter_by(key="title").first() is None:
+            s.add(Setting(key="title", value="National Gymnastics Rankings – Romania"))
+            s.add(Setting(key="subtitle", value="Official RENC"))
+        s.commit()
+    finally:
+        s.close()
+
+# --- Bulk ingest ---
+# Column order of the rows produced by RowValidator; REQUIRED_HEADERS map 1:1 onto RANKING_COLUMNS[1:]
+RANKING_COLUMNS = [
+    "category_id","position","competitor","club","execution","artistry",
+    "difficulty","line_penalty","chair_penalty","diff_penalty","total"
+]
+INGEST_CHUNK_ROWS = int(os.environ.get("INGEST_CHUNK_ROWS", "2000"))
+
+def read_csv_rows(stream):
+    reader = csv.reader(io.TextIOWrapper(stream, encoding="utf-8", newline=""))
+    headers = [(h or "").strip() for h in next(reader, [])]
+    return headers, reader
+
+def read_xlsx_rows(stream):
+    import openpyxl
+    wb = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+    rows = wb.active.iter_rows(values_only=True)
+    headers = [str(h if h is not None else "").strip() for h in next(rows, ())]
+    def body():
+        try:
+            yield from rows
+        finally:
+            wb.close()
+    return headers, body()
+
+def read_upload_rows(filename, stream):
+    # -> (headers, row iterator) or None for unsupported file types
+    name = filename.lower()
+    if name.endswith(".csv"):
+        return read_csv_rows(stream)
+    if name.endswith(".xlsx"):
+        return read_xlsx_rows(stream)
+    return None
+
+# --- Upload parsing & validation ---
+# Rows are checked a chunk at a time, column by column: a CSV column is one join/replace/split
+# and a float() per cell in a single comprehension; only a column that fails that falls back
+# to cell-by-cell parsing to pinpoint the bad cells.
+TEXT_HEADERS = REQUIRED_HEADERS[:3]
+NUMBER_HEADERS = REQUIRED_HEADERS[3:]
+# TOTAL must equal EXECUTION + ARTISTRY + DIFFICULTY - penalties within this; negative disables
+TOTAL_TOLERANCE = float(os.environ.get("TOTAL_TOLERANCE", "0.005"))
+MAX_REPORTED_ERRORS = 100
+_BAD = object()
+_SEP = "\x1f"
+
+def parse_number(v):
+    # One cell -> float, None for empty, _BAD if it isn't a number. Accepts "8,500" and "1.234,5".
+    if v is None:
+        return None
+    if isinstance(v, (int, float, Decimal)) and not isinstance(v, bool):
+        n = float(v)
+        return n if math.isfinite(n) else _BAD
+    text = str(v).strip()
+    if not text:
+        return None
+    if "," in text:
+        if "." in text and text.rindex(".") > text.rindex(","):
+            text = text.replace(",", "")  # 1,234.5
+        else:
+            text = text.replace(".", "").replace(",", ".")  # 8,5 / 1.234,5
+    try:
+        n = float(text)
+    except ValueError:
+        return _BAD
+    return n if math.isfinite(n) else _BAD
+
+def parse_column(values):
+    # -> (numbers, indexes of bad cells) for one column
+    try:
+        cells = _SEP.join(values).replace(",", ".").split(_SEP)
+        if len(cells) != len(values):  # a cell contained the separator: parse cell by cell
+            cells = values
+    except TypeError:  # XLSX: numbers and None, possibly mixed with text
+        # TRUE/FALSE cells come as bools, which float() takes but parse_number() rejects
+        cells = None if any(type(c) is bool for c in values) else values
+    if cells is not None:
+        try:
+            nums = [None if c is None or c == "" else float(c) for c in cells]
+            if all(n is None or math.isfinite(n) for n in nums):
+                return nums, []
+        except (TypeError, ValueError):
+            pass
+    nums, bad = [], []
+    for i, v in enumerate(values):
+        n = parse_number(v)
+        if n is _BAD:
+            bad.append(i)
+            n = None
+        nums.append(n)
+    return nums, bad
+
+def text_column(values):
+    return ["" if v is None else str(v) for v in values]
+
+class RowValidator:
+    # Iterating yields ready-to-insert tuples until the first chunk with a bad row, then stops
+    # feeding the database; drain() checks the rest so `errors` covers the whole file.
+    def __init__(self, category_id, headers, rows):
+        self.category_id = category_id
+        self.idx = [headers.index(h) for h in REQUIRED_HEADERS]
+        self.width = max(self.idx) + 1
+        self.rows = enumerate(rows, 2)  # spreadsheet row numbers; the header is row 1
+        self.errors = []
+        self.error_count = 0
+        self.rows_checked = 0
+
+    def __iter__(self):
+        for chunk in chunked(self.rows, INGEST_CHUNK_ROWS):
+            out = self.check(chunk)
+            if self.error_count:
+                return
+            yield from out
+
+    def drain(self):
+        for chunk in chunked(self.rows, INGEST_CHUNK_ROWS):
+            self.check(chunk)
+
+    def error(self, line, column, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": line, "column": column, "message": message})
+
+    def check(self, chunk):
+        width = self.width
+        lines, cells = [], []
+        for line, row in chunk:
+            if not any(v is not None and v != "" for v in row):
+                continue  # blank line / empty sheet row
+            if len(row) < width:
+                row = tuple(row) + (None,) * (width - len(row))
+            lines.append(line)
+            cells.append([row[i] for i in self.idx])
+        self.rows_checked += len(lines)
+        if not cells:
+            return []
+        columns = list(zip(*cells))
+        text = [text_column(col) for col in columns[:3]]
+        numbers = []
+        for header, col in zip(NUMBER_HEADERS, columns[3:]):
+            nums, bad = parse_column(col)
+            for i in bad:
+                self.error(lines[i], header, f"not a number: {col[i]!r}")
+            numbers.append(nums)
+        if TOTAL_TOLERANCE >= 0:
+            for i, (e, a, d, lp, cp, dp, t) in enumerate(zip(*numbers)):
+                if t is None or e is None or a is None or d is None:
+                    continue
+                expected = e + a + d - abs(lp or 0) - abs(cp or 0) - abs(dp or 0)
+                if abs(expected - t) > TOTAL_TOLERANCE:
+                    self.error(lines[i], "TOTAL", f"{t:.3f} does not match EXECUTION + ARTISTRY + "
+                                                  f"DIFFICULTY - penalties = {expected:.3f}")
+        cat = [self.category_id] * len(lines)
+        return list(zip(cat, *text, *numbers))
+
+def chunked(it, size):
+    it = iter(it)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+def bulk_insert(s, table, columns, rows):
+    # COPY on Postgres, executemany elsewhere; runs in the session's transaction.
+    conn = s.connection()
+    count = 0
+    if conn.dialect.name == "postgresql":
+        cur = conn.connection.cursor()
+        try:
+            with cur.copy(f"COPY {table.name} ({', '.join(columns)}) FROM STDIN") as copy:
+                for row in rows:
+                    copy.write_row(row); count += 1
+        finally:
+            cur.close()
+    else:
+        stmt = table.insert()
+        for chunk in chunked(rows, INGEST_CHUNK_ROWS):
+            conn.execute(stmt, [dict(zip(columns, r)) for r in chunk])
+            count += len(chunk)
+    return count
+
+def staging_batch_id():
+    # creation time first, so sweep_ingest() can drop batches of processes that died mid-upload
+    return "%010d%s" % (time.time(), uuid.uuid4().hex[:22])
+
+def replace_category_rows(s, cat, rows, before_swap=None):
+    # Load into staging (long, touches only rankings_staging), then swap in one short transaction.
+    # before_swap() may raise to abandon the upload before the staging rows are committed.
+    batch = staging_batch_id()
+    staging = RankingStaging.__table__
+    try:
+        count = bulk_insert(s, staging, ["batch"] + RANKING_COLUMNS, ((batch,) + r for r in rows))
+        if before_swap:
+            before_swap()
+        s.execute(rank_rows(staging, staging.c.batch == batch))
+        s.commit()
+        # lock the category row so two replaces of the same category can't interleave
+        s.query(Category).filter_by(id=cat.id).with_for_update().one()
+        s.query(Ranking).filter_by(category_id=cat.id).delete(synchronize_session=False)
+        s.execute(Ranking.__table__.insert().from_select(
+            RANKING_COLUMNS + ["rank", "medal"],
+            select(*[staging.c[c] for c in RANKING_COLUMNS + ["rank", "medal"]])
+              .where(staging.c.batch == batch)
+              .order_by(staging.c.id)))
+        s.query(RankingStaging).filter_by(batch=batch).delete(synchronize_session=False)
+        refresh_stats(s, cat.id)
+        data_changed(s, cat.slug)
+        s.commit()
+    except Exception:
+        s.rollback()
+        s.query(RankingStaging).filter_by(batch=batch).delete(synchronize_session=False)
+        s.commit()
+        raise
+    return count
+
+def get_or_create_category(s, name):
+    slug = slugify(name)
+    cat = s.query(Category).filter_by(slug=slug).first()
+    if cat:
+        return cat
+    try:
+        cat = Category(slug=slug, name=name)
+        s.add(cat); site_changed(s); s.commit(); s.refresh(cat)
+        return cat
+    except IntegrityError as e:
+        s.rollback()
+        if not unique_violation(e, "categories", "slug"):
+            raise
+        # created concurrently (e.g. two ZIP members for one category)
+        return s.query(Category).filter_by(slug=slug).one()
+
+def unique_violation(e, table, col):
+    orig = e.orig
+    if getattr(orig, "sqlstate", None) == "23505":  # psycopg
+        diag = getattr(orig, "diag", None)
+        return (getattr(diag, "table_name", None) == table
+                and col in (getattr(diag, "constraint_name", None) or ""))
+    return f"UNIQUE constraint failed: {table}.{col}" in str(orig)  # sqlite
+
+# --- Background ingest ---
+# Uploads are spooled to disk and processed by a bounded thread pool; the client polls
+# /upload/jobs/<id>. Job rows live in the database so any worker can answer the poll; the
+# rows-parsed counter of a running file is only live on the worker that runs it.
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", "2"))
+INGEST_MAX_PENDING = int(os.environ.get("INGEST_MAX_PENDING", "20"))
+INGEST_SPOOL_DIR = os.environ.get("INGEST_SPOOL_DIR") or os.path.join(tempfile.gettempdir(), "gym-ingest")
+ZIP_MAX_MEMBERS = 200
+ZIP_MAX_MEMBER_BYTES = 100 * 1024 * 1024
+# queued/running jobs without a heartbeat() for this long, and not running in this process,
+# were orphaned by a worker restart; job_status() and init-db mark them failed
+INGEST_STALE_SECONDS = int(os.environ.get("INGEST_STALE_SECONDS", "600"))
+PROGRESS_EVERY_ROWS = 500
+
+class IngestError(Exception):
+    def __init__(self, message, details=()):
+        super().__init__(message)
+        self.details = list(details)
+
+_ingest_pool = None
+_ingest_live = {}  # job id -> rows parsed so far, for jobs running in this process
+_ingest_lock = threading.Lock()
+
+def ingest_pool():
+    global _ingest_pool
+    with _ingest_lock:
+        if _ingest_pool is None:
+            _ingest_pool = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+    return _ingest_pool
+
+def upload_kind(filename):
+    ext = os.path.splitext(filename.lower())[1]
+    return ext[1:] if ext in (".csv", ".xlsx", ".zip") else None
+
+def submit_ingest(s, file, kind, cat_slug, mode):
+    # -> job id, or None when too many uploads are already waiting in this worker
+    job_id = uuid.uuid4().hex
+    with _ingest_lock:
+        if len(_ingest_live) >= INGEST_MAX_PENDING:
+            return None
+        _ingest_live[job_id] = 0
+    try:
+        job_dir = os.path.join(INGEST_SPOOL_DIR, job_id)
+        os.makedirs(job_dir, exist_ok=True)
+        path = os.path.join(job_dir, "upload." + kind)
+        file.save(path)
+        now = datetime.now(timezone.utc)
+        s.add(IngestJob(id=job_id, status="queued", filename=file.filename[:300], category_slug=cat_slug,
+                        mode=mode, files_total=0 if kind == "zip" else 1, files_done=0, rows_parsed=0,
+                        rows_inserted=0, errors="[]", created_at=now, updated_at=now))
+        s.commit()
+    except Exception:
+        with _ingest_lock:
+            _ingest_live.pop(job_id, None)
+        shutil.rmtree(os.path.join(INGEST_SPOOL_DIR, job_id), ignore_errors=True)
+        raise
+    if kind == "zip":
+        ingest_pool().submit(run_zip_job, job_id, path, file.filename, mode)
+    else:
+        ingest_pool().submit(ingest_file, job_id, path, file.filename, cat_slug, mode)
+    return job_id
+
+def update_job(job_id, errors=(), **counters):
+    # counters are added to the job's columns; status=... is set as-is
+    status = counters.pop("status", None)
+    with session_scope() as s:
+        values = {getattr(IngestJob, k): getattr(IngestJob, k) + v for k, v in counters.items()}
+        values[IngestJob.updated_at] = datetime.now(timezone.utc)
+        if status:
+            values[IngestJob.status] = status
+        if errors:
+            with _ingest_lock:  # read-modify-write of the JSON list; all files of a job share this process
+                current = json.loads(s.query(IngestJob.errors).filter_by(id=job_id).scalar() or "[]")
+                values[IngestJob.errors] = json.dumps(current + list(errors))
+                s.query(IngestJob).filter_by(id=job_id).update(values, synchronize_session=False)
+                s.commit()
+            return
+        s.query(IngestJob).filter_by(id=job_id).update(values, synchronize_session=False)
+        s.commit()
+
+def finish_file(job_id):
+    # The thread that finishes the last file of a job closes the job.
+    try:
+        update_job(job_id, files_done=1)
+        with session_scope() as s:
+            job = s.get(IngestJob, job_id)
+            if job.files_done < job.files_total:
+                return
+            failed = job.errors != "[]" and job.rows_inserted == 0
+        update_job(job_id, status="failed" if failed else "done")
+    except Exception:
+        # database unreachable: still free the slot, so the job can go stale and be failed later
+        app.logger.exception("ingest job %s: could not record completion", job_id)
+        with _ingest_lock:
+            _ingest_live.pop(job_id, None)
+        return
+    with _ingest_lock:
+        _ingest_live.pop(job_id, None)
+    shutil.rmtree(os.path.join(INGEST_SPOOL_DIR, job_id), ignore_errors=True)
+
+def heartbeat(job_id, parsed=0):
+    # Touch updated_at of every job this process holds (queued ones too), so fail_stale_jobs()
+    # on another worker leaves them alone, and persist rows parsed so far. -> False when skipped:
+    # on SQLite the upload's own transaction may hold the write lock, so don't wait for it.
+    engine = get_engine()
+    if isinstance(engine.pool, StaticPool):
+        return False  # in-memory SQLite: one shared connection, this would commit the upload mid-way
+    with _ingest_lock:
+        live = list(_ingest_live) or [job_id]
+    with engine.connect() as conn:
+        sqlite = conn.dialect.name == "sqlite"
+        if sqlite:
+            conn.exec_driver_sql("PRAGMA busy_timeout=0")
+        jobs = IngestJob.__table__
+        try:
+            conn.execute(jobs.update().where(jobs.c.id.in_(live))
+                         .values(updated_at=datetime.now(timezone.utc)))
+            if parsed:
+                conn.execute(jobs.update().where(jobs.c.id == job_id)
+                             .values(rows_parsed=jobs.c.rows_parsed + parsed))
+            conn.commit()
+            return True
+        except OperationalError:
+            conn.rollback()
+            if not sqlite:
+                raise
+            return False
+        finally:
+            if sqlite:
+                conn.exec_driver_sql(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+
+def track_parsed(job_id, rows, counter):
+    # counter: [rows parsed, of which already saved by heartbeat()]
+    pending = 0
+    for row in rows:
+        yield row
+        counter[0] += 1
+        pending += 1
+        if pending == PROGRESS_EVERY_ROWS:
+            with _ingest_lock:
+                _ingest_live[job_id] = _ingest_live.get(job_id, 0) + pending
+            if heartbeat(job_id, counter[0] - counter[1]):
+                counter[1] = counter[0]
+            pending = 0
+    with _ingest_lock:
+        _ingest_live[job_id] = _ingest_live.get(job_id, 0) + pending
+
+def ingest_file(job_id, path, filename, cat_slug=None, mode="append", cat_name=None):
+    parsed, inserted, errors = [0, 0], 0, []
+    update_job(job_id, status="running")
+    heartbeat(job_id)  # dequeued: also refresh this worker's jobs still waiting in the pool
+    s = SessionLocal()
+    try:
+        with open(path, "rb") as f:
+            result = read_upload_rows(filename, f)
+            if result is None:
+                raise IngestError("Unsupported file type. Use CSV or XLSX.")
+            headers, rows = result
+            missing = [h for h in REQUIRED_HEADERS if h not in headers]
+            if missing:
+                raise IngestError("Missing required columns: " + ", ".join(missing))
+            if cat_slug:
+                cat = s.query(Category).filter_by(slug=cat_slug).first()
+                if not cat:
+                    raise IngestError("Category not found.")
+            else:
+                cat = get_or_create_category(s, cat_name)
+            validator = RowValidator(cat.id, headers, rows)
+
+            def check():
+                # nothing is committed unless every row of the file is valid
+                validator.drain()
+                parsed[0] = validator.rows_checked
+                if validator.error_count:
+                    raise IngestError(f"{validator.error_count} invalid value(s); nothing was imported.",
+                                      validator.errors)
+
+            rows = track_parsed(job_id, validator, parsed)
+            if mode == "replace":
+                inserted = replace_category_rows(s, cat, rows, before_swap=check)
+            else:
+                inserted = bulk_insert(s, Ranking.__table__, RANKING_COLUMNS, rows)
+                check()
+                recompute_ranks(s, cat.id)
+                refresh_stats(s, cat.id)
+                data_changed(s, cat.slug)
+                s.commit()
+    except IngestError as e:
+        s.rollback()
+        inserted = 0
+        errors.append({"file": filename, "message": str(e)})
+        errors.extend(dict(d, file=filename) for d in e.details)
+    except Exception as e:
+        s.rollback()
+        app.logger.exception("ingest job %s: %s failed", job_id, filename)
+        errors.append({"file": filename, "message": f"Could not import file: {e.__class__.__name__}"})
     finally:
         s.close()
+        try:
+            update_job(job_id, errors, rows_parsed=parsed[0] - parsed[1], rows_inserted=inserted)
+        finally:
+            finish_file(job_id)
+
+def run_zip_job(job_id, path, filename, mode):
+    # Unpack CSV/XLSX members (one category each, named after the file) and ingest them in
+    # parallel on the same pool; the last one to finish closes the job.
+    members, errors = [], []
+    try:
+        update_job(job_id, status="running")
+        with zipfile.ZipFile(path) as zf:
+            infos = [i for i in zf.infolist()
+                     if not i.is_dir() and not os.path.basename(i.filename).startswith(".")
+                     and "__MACOSX" not in i.filename]
+            for n, info in enumerate(infos):
+                name = os.path.basename(info.filename)
+                kind = upload_kind(name)
+                if kind not in ("csv", "xlsx"):
+                    errors.append({"file": name, "message": "Skipped: not a CSV or XLSX file."})
+                elif n >= ZIP_MAX_MEMBERS or info.file_size > ZIP_MAX_MEMBER_BYTES:
+                    errors.append({"file": name, "message": "Skipped: too many or too large files in ZIP."})
+                else:
+                    member_path = os.path.join(os.path.dirname(path), f"member-{n}.{kind}")
+                    try:
+                        with zf.open(info) as src, open(member_path, "wb") as dst:
+                            # file_size is only what the ZIP header claims: cap what is really written
+                            complete = copy_capped(src, dst, ZIP_MAX_MEMBER_BYTES)
+                    except (RuntimeError, NotImplementedError, zipfile.BadZipFile) as e:
+                        if os.path.exists(member_path):
+                            os.remove(member_path)
+                        reason = ("password-protected" if isinstance(e, RuntimeError) else
+                                  "unsupported compression method" if isinstance(e, NotImplementedError) else
+                                  "corrupt data")
+                        errors.append({"file": name, "message": f"Skipped: cannot unpack file ({reason})."})
+                        continue
+                    if complete:
+                        members.append((member_path, name, os.path.splitext(name)[0].strip()))
+                    else:
+                        os.remove(member_path)
+                        errors.append({"file": name, "message": "Skipped: too many or too large files in ZIP."})
+    except zipfile.BadZipFile:
+        members = []
+        errors.append({"file": filename, "message": "Not a valid ZIP file."})
+    except Exception as e:
+        members = []
+        app.logger.exception("ingest job %s: unpacking %s failed", job_id, filename)
+        errors.append({"file": filename, "message": f"Could not unpack ZIP file: {e.__class__.__name__}"})
+    if not members:
+        # always close the job: frees its INGEST_MAX_PENDING slot and spool directory
+        try:
+            update_job(job_id, errors or [{"file": "", "message": "ZIP contains no CSV or XLSX files."}],
+                       files_total=1)
+        finally:
+            finish_file(job_id)
+        return
+    update_job(job_id, errors, files_total=len(members))
+    for member_path, name, cat_name in members:
+        ingest_pool().submit(ingest_file, job_id, member_path, name, None, mode, cat_name)
+
+def copy_capped(src, dst, limit, chunk=1024 * 1024):
+    # -> False (and stops) once more than `limit` bytes would be written
+    written = 0
+    while True:
+        buf = src.read(min(chunk, limit + 1 - written))
+        if not buf:
+            return True
+        written += len(buf)
+        if written > limit:
+            return False
+        dst.write(buf)
+
+def fail_stale_jobs(s, job_id=None):
+    # Jobs whose worker died (restart, redeploy) would otherwise stay queued/running forever.
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=INGEST_STALE_SECONDS)
+    q = s.query(IngestJob).filter(IngestJob.status.in_(("queued", "running")), IngestJob.updated_at < cutoff)
+    if job_id is not None:
+        q = q.filter(IngestJob.id == job_id)
+    with _ingest_lock:
+        live = set(_ingest_live)
+    failed = 0
+    for job in q.all():
+        if job.id in live:
+            continue
+        errors = json.loads(job.errors or "[]")
+        errors.append({"file": job.filename, "message": "Processing was interrupted by a server restart; please upload again."})
+        job.errors = json.dumps(errors)
+        job.status = "failed"
+        job.updated_at = datetime.now(timezone.utc)
+        shutil.rmtree(os.path.join(INGEST_SPOOL_DIR, job.id), ignore_errors=True)
+        failed += 1
+    s.commit()
+    return failed
+
+def sweep_ingest():
+    # init-db: fail orphaned jobs, drop their spool directories and abandoned staging batches
+    cutoff = time.time() - INGEST_STALE_SECONDS
+    with session_scope() as s:
+        failed = fail_stale_jobs(s)
+        s.query(RankingStaging).filter(RankingStaging.batch < "%010d" % cutoff).delete(synchronize_session=False)
+        s.commit()
+        active = {j for (j,) in s.query(IngestJob.id).filter(IngestJob.status.in_(("queued", "running")))}
+    if os.path.isdir(INGEST_SPOOL_DIR):
+        for name in os.listdir(INGEST_SPOOL_DIR):
+            path = os.path.join(INGEST_SPOOL_DIR, name)
+            if name not in active and os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+    return failed
+
+def job_status(s, job_id):
+    job = s.get(IngestJob, job_id)
+    if job is None:
+        return None
+    if job.status in ("queued", "running") and fail_stale_jobs(s, job_id):
+        s.refresh(job)
+    rows_parsed = job.rows_parsed
+    with _ingest_lock:
+        if job_id in _ingest_live:
+            rows_parsed = max(rows_parsed, _ingest_live[job_id])
+    return {
+        "id": job.id, "status": job.status, "filename": job.filename,
+        "category_slug": job.category_slug, "mode": job.mode,
+        "files_total": job.files_total, "files_done": job.files_done,
+        "rows_parsed": rows_parsed, "rows_inserted": job.rows_inserted,
+        "errors": json.loads(job.errors or "[]"),
+        "finished": job.status in ("done", "failed"),
+    }
+
+# --- Rendered page cache ---
+class PageCache:
+    # LRU of rendered pages, bounded by total body size in bytes
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] != version:
+                return None
+            self._items.move_to_end(key)
+            return item[1]
+
+    def put(self, key, version, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1])
+            self._items[key] = (version, body)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+page_cache = PageCache(int(float(os.environ.get("PAGE_CACHE_MB", "32")) * 1024 * 1024))
+
+def not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if last_modified and request.if_modified_since:
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+PAGE_ARGS = ("category", "limit", "after", "all", "fields")  # q is normalised into the slug
+
+def page_args():
+    # only the parameters pages read go into the cache key: ?x=<random> must not add entries
+    return tuple((k, request.args[k]) for k in PAGE_ARGS if k in request.args)
+
+def render_cached(s, slug, scopes, render, store=True, mimetype="text/html"):
+    # store=False: still answer conditional GETs, but render() returns a (streamed) response
+    # that is not kept in the page cache.
+    # Flashed messages belong to one visitor: render those pages fresh and don't store them
+    if mimetype == "text/html" and "_flashes" in session:
+        return render()
+    lang = get_lang()
+    version, last_modified = read_versions(s, scopes)
+    if scopes[0] == SITE_SCOPE:
+        settings_store.note_version(version[0])
+    etag = "-".join([BUILD_TOKEN, lang] + [str(v) for v in version])
+    last_modified = max(last_modified, BUILD_STARTED) if last_modified else BUILD_STARTED
+    if not_modified(etag, last_modified):
+        resp = make_response("", 304)
+    elif not store:
+        resp = make_response(render())
+    else:
+        key = (request.endpoint, slug, lang, page_args())
+        body = page_cache.get(key, version)
+        if body is None:
+            body = render().encode("utf-8")
+            page_cache.put(key, version, body)
+        encoding = accepted_encoding() if len(body) >= COMPRESS_MIN_BYTES else None
+        if encoding:
+            # compressed once per page version, next to the plain body
+            plain, body = body, page_cache.get(key + (encoding,), version)
+            if body is None:
+                body = compress(plain, encoding, compress_level(encoding))
+                page_cache.put(key + (encoding,), version, body)
+        resp = make_response(body)
+        resp.mimetype = mimetype
+        if encoding:
+            resp.headers["Content-Encoding"] = encoding
+    resp.set_etag(etag, weak=True)
+    if last_modified:
+        resp.last_modified = last_modified
+    resp.headers["Cache-Control"] = "public, no-cache"
+    resp.vary.add("Cookie")  # language comes from the "lang" cookie
+    resp.vary.add("Accept-Encoding")
+    return resp
+
+# --- Compression ---
+# HTML/JSON bodies are sent with brotli (when the package is installed) or gzip. Pages served
+# through render_cached() keep their compressed bodies in the page cache; other responses are
+# compressed on the fly in compress_response(). Streamed bodies are sent as they are.
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_MIMETYPES = {"text/html", "application/json", "text/plain", "text/csv"}
+CACHED_LEVELS = {"br": 11, "gzip": 9}
+LIVE_LEVELS = {"br": 4, "gzip": 6}
+HOT_ENDPOINTS = {"home": {"category"}, "category_page": set()}  # endpoint -> args allowed
+
+def compress_level(encoding):
+    # Max level only for the few hot pages (home, first page of a category), whose compressed
+    # body is reused until the data changes; search results, cursor pages and any other query
+    # string have mostly unique keys and get the fast level.
+    hot_args = HOT_ENDPOINTS.get(request.endpoint)
+    if hot_args is not None and set(request.args) <= hot_args:
+        return CACHED_LEVELS[encoding]
+    return LIVE_LEVELS[encoding]
+
+def accepted_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        return "br"
+    if accepted["gzip"]:
+        return "gzip"
+    return None
+
+def compress(body, encoding, level):
+    if encoding == "br":
+        return brotli.compress(body, quality=level)
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+@app.after_request
+def compress_response(resp):
+    if (resp.status_code != 200 or resp.is_streamed or resp.direct_passthrough
+            or "Content-Encoding" in resp.headers or resp.mimetype not in COMPRESS_MIMETYPES):
+        return resp
+    resp.vary.add("Accept-Encoding")
+    body = resp.get_data()
+    encoding = accepted_encoding() if len(body) >= COMPRESS_MIN_BYTES else None
+    if encoding:
+        resp.set_data(compress(body, encoding, LIVE_LEVELS[encoding]))
+        resp.headers["Content-Encoding"] = encoding
+    return resp
+
+# --- Pagination & streaming ---
+CATEGORY_PAGE_SIZE = int(os.environ.get("CATEGORY_PAGE_SIZE", "100"))
+CATEGORY_PAGE_MAX = 1000
+STREAM_FETCH_ROWS = 500
+STREAM_CHUNK_BYTES = 16 * 1024
+
+def page_limit(value, default=None):
+    try:
+        n = int(value)
+    except (TypeError, ValueError):
+        return default or CATEGORY_PAGE_SIZE
+    return max(1, min(n, CATEGORY_PAGE_MAX))
 
-seed_if_empty()
+def encode_cursor(*values):
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def after_rank(t, cursor):
+    # keyset condition for (rank, id) > cursor
+    rank, rid = cursor
+    return or_(t.c.rank > rank, and_(t.c.rank == rank, t.c.id > rid))
+
+RANK_CURSOR = (int, int)  # (rank, id)
+NAME_CURSOR = (str, int)  # (name, id)
+
+def decode_cursor(token, types):
+    # -> list of values matching `types`, or None for a missing/garbled cursor
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except ValueError:
+        return None
+    if not isinstance(values, list) or len(values) != len(types):
+        return None
+    if not all(isinstance(v, t) and not isinstance(v, bool) for v, t in zip(values, types)):
+        return None
+    return values
+
+def buffered(pieces, size):
+    buf, n = [], 0
+    for piece in pieces:
+        buf.append(piece)
+        n += len(piece)
+        if n >= size:
+            yield "".join(buf)
+            buf, n = [], 0
+    if buf:
+        yield "".join(buf)
+
+# --- Read-only API & exports ---
+# Plain Core selects (no ORM identity map); numbers go out as JSON floats.
+API_CATEGORY_FIELDS = ["id", "slug", "name"]
+API_RANKING_FIELDS = ["id", "rank", "medal"] + RANKING_COLUMNS[1:]
+
+def api_error(message, status):
+    return jsonify(error=message), status
+
+def parse_fields(allowed):
+    # ?fields=a,b -> list of columns (all when absent), or None if one is unknown
+    raw = request.args.get("fields", "").strip()
+    if not raw:
+        return list(allowed)
+    fields = [f.strip() for f in raw.split(",") if f.strip()]
+    if not fields or any(f not in allowed for f in fields):
+        return None
+    return fields
+
+def json_value(v):
+    return float(v) if isinstance(v, Decimal) else v
+
+def api_response(s, slug, scopes, build):
+    def render():
+        return json.dumps(build(), separators=(",", ":"), ensure_ascii=False)
+    return render_cached(s, slug, scopes, render, mimetype="application/json")
+
+def export_rows(s, category_id):
+    # (POSITION ... TOTAL) tuples in ranking order, fetched in batches
+    table = Ranking.__table__
+    stmt = (select(*[table.c[c] for c in RANKING_COLUMNS[1:]])
+              .where(table.c.category_id == category_id)
+              .order_by(*rank_order(table))
+              .execution_options(yield_per=STREAM_FETCH_ROWS))
+    for row in s.execute(stmt):
+        yield tuple(json_value(v) for v in row)
+
+def csv_stream(rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(REQUIRED_HEADERS)
+    for chunk in chunked(rows, STREAM_FETCH_ROWS):
+        writer.writerows(chunk)
+        yield buf.getvalue()
+        buf.seek(0); buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+def xlsx_file(rows):
+    # write-only workbook: rows go straight to openpyxl's temp XML, the zip is built in a temp file
+    import openpyxl
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(REQUIRED_HEADERS)
+    for row in rows:
+        ws.append(row)
+    out = tempfile.TemporaryFile()
+    wb.save(out)
+    out.seek(0)
+    return out
+
+@app.route("/api/categories")
+def api_categories():
+    fields = parse_fields(API_CATEGORY_FIELDS)
+    if fields is None:
+        return api_error("unknown field; allowed: " + ",".join(API_CATEGORY_FIELDS), 400)
+    limit = page_limit(request.args.get("limit"), CATEGORY_PAGE_MAX)
+    after = decode_cursor(request.args.get("after", ""), NAME_CURSOR)
+    s = get_db()
+    table = Category.__table__
+
+    def build():
+        stmt = select(*[table.c[f] for f in fields], table.c.name.label("_name"), table.c.id.label("_id"))
+        if after:
+            stmt = stmt.where(or_(table.c.name > after[0], and_(table.c.name == after[0], table.c.id > after[1])))
+        rows = s.execute(stmt.order_by(table.c.name, table.c.id).limit(limit + 1)).all()
+        nxt = encode_cursor(rows[limit - 1]._name, rows[limit - 1]._id) if len(rows) > limit else None
+        return {"items": [{f: getattr(r, f) for f in fields} for r in rows[:limit]], "next": nxt}
+    return api_response(s, "", [SITE_SCOPE], build)
+
+@app.route("/api/categories/<slug>/rankings")
+def api_rankings(slug):
+    fields = parse_fields(API_RANKING_FIELDS)
+    if fields is None:
+        return api_error("unknown field; allowed: " + ",".join(API_RANKING_FIELDS), 400)
+    limit = page_limit(request.args.get("limit"))
+    after = decode_cursor(request.args.get("after", ""), RANK_CURSOR)
+    s = get_db()
+    cat = find_category(s, slug)
+    if cat is None:
+        return api_error("category not found", 404)
+    table = Ranking.__table__
+
+    def build():
+        stmt = (select(*[table.c[f] for f in fields], table.c.rank.label("_rank"), table.c.id.label("_id"))
+                  .where(table.c.category_id == cat.id))
+        if after:
+            stmt = stmt.where(after_rank(table, after))
+        rows = s.execute(stmt.order_by(*rank_order(table)).limit(limit + 1)).all()
+        nxt = encode_cursor(rows[limit - 1]._rank, rows[limit - 1]._id) if len(rows) > limit else None
+        return {
+            "category": {"slug": cat.slug, "name": cat.name},
+            "items": [{f: json_value(getattr(r, f)) for f in fields} for r in rows[:limit]],
+            "next": nxt,
+        }
+    return api_response(s, slug, [SITE_SCOPE, cat_scope(slug)], build)
+
+@app.route("/category/<slug>/export.<any(csv, xlsx):fmt>")
+def export_category(slug, fmt):
+    s = get_db()
+    cat = s.query(Category).filter_by(slug=slug).first()
+    if not cat:
+        flash("Categoria nu exista.", "error")
+        return redirect(url_for("home"))
+    rows = export_rows(s, cat.id)
+    if fmt == "csv":
+        resp = app.response_class(stream_with_context(csv_stream(rows)), mimetype="text/csv")
+        resp.headers["Content-Disposition"] = f'attachment; filename="{cat.slug}.csv"'
+        return resp
+    return send_file(xlsx_file(rows), as_attachment=True, download_name=f"{cat.slug}.xlsx",
+                     mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+
+# --- Search ---
+SearchHit = namedtuple("SearchHit", "competitor club position rank medal total category_slug category_name")
+SEARCH_LIMIT = 50
+SEARCH_MIN_CHARS = 2
+_search_backend = None
+
+def search_backend(s):
+    # "trgm_unaccent", "trgm", "fts5" or "like"; looked up once per worker
+    global _search_backend
+    if _search_backend is None:
+        dialect = s.get_bind().dialect.name
+        backend = "like"
+        if dialect == "postgresql":
+            if s.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first():
+                backend = "trgm"
+                if s.execute(text("SELECT 1 FROM pg_proc WHERE proname = 'gym_unaccent'")).first():
+                    backend = "trgm_unaccent"
+        elif dialect == "sqlite":
+            if s.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'rankings_fts'")).first():
+                backend = "fts5"
+        _search_backend = backend
+    return _search_backend
+
+def like_escape(q):
+    return q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def fts_query(q):
+    # every word as a quoted prefix term: ion pop -> "ion"* "pop"*
+    return " ".join('"%s"*' % w.replace('"', '""') for w in q.split())
+
+def search_rankings(s, q, limit=SEARCH_LIMIT):
+    r, c = Ranking.__table__, Category.__table__
+    stmt = (select(r.c.competitor, r.c.club, r.c.position, r.c.rank, r.c.medal, r.c.total, c.c.slug, c.c.name)
+              .select_from(r.join(c, c.c.id == r.c.category_id)))
+    backend = search_backend(s)
+    # trgm_unaccent: both sides go through gym_unaccent(), matching the expression indexes
+    fold = func.gym_unaccent if backend == "trgm_unaccent" else (lambda v: v)
+    cols = [fold(r.c.competitor), fold(r.c.club)]
+    prefix = like_escape(q) + "%"
+    like = or_(*[col.ilike(fold(p), escape="\\") for col in cols for p in (prefix, "% " + prefix)])
+    if backend in ("trgm", "trgm_unaccent"):
+        needle = fold(q)
+        score = func.greatest(*[func.similarity(col, needle) for col in cols])
+        stmt = (stmt.where(or_(*[col.op("%")(needle) for col in cols], like))
+                    .order_by(score.desc(), r.c.rank, r.c.id))
+    elif backend == "fts5":
+        matches = text("SELECT rowid FROM rankings_fts WHERE rankings_fts MATCH :m").columns(column("rowid"))
+        stmt = (stmt.where(r.c.id.in_(matches.bindparams(m=fts_query(q))))
+                    .order_by(r.c.competitor, c.c.name, r.c.rank))
+    else:
+        stmt = stmt.where(like).order_by(r.c.competitor, c.c.name, r.c.rank)
+    hits = []
+    for row in s.execute(stmt.limit(limit)):
+        hits.append(SearchHit(*row[:5], fmt_score(row[5]), row[6], row[7]))
+    return hits
+
+def search_query():
+    q = " ".join((request.args.get("q") or "").split())[:100]
+    return q if len(q) >= SEARCH_MIN_CHARS else ""
+
+@app.route("/search")
+def search():
+    q = search_query()
+    s = get_db()
+
+    def render():
+        hits = search_rankings(s, q) if q else []
+        return render_template("search.html", settings=get_settings(), q=q, hits=hits)
+    return render_cached(s, q, [SITE_SCOPE, HOME_SCOPE], render)
+
+@app.route("/api/search")
+def api_search():
+    q = search_query()
+    if not q:
+        return api_error(f"q must have at least {SEARCH_MIN_CHARS} characters", 400)
+    s = get_db()
+
+    def build():
+        return {"q": q, "items": [
+            {"competitor": h.competitor, "club": h.club, "position": h.position, "rank": h.rank,
+             "medal": h.medal, "total": float(h.total) if h.total else None,
+             "category": {"slug": h.category_slug, "name": h.category_name}}
+            for h in search_rankings(s, q)
+        ]}
+    return api_response(s, q, [SITE_SCOPE, HOME_SCOPE], build)
+
+# --- Stats pages ---
+@app.route("/stats")
+def stats():
+    s = get_db()
+
+    def render():
+        return render_template("stats.html", settings=get_settings(),
+                               clubs=club_standings(s), cats=load_category_stats(s))
+    return render_cached(s, None, [SITE_SCOPE, HOME_SCOPE], render)
+
+@app.route("/api/stats")
+def api_stats():
+    s = get_db()
+
+    def build():
+        return {
+            "clubs": [c._asdict() for c in club_standings(s)],
+            "categories": [
+                {k: round(v, 3) if isinstance(v, float) else v
+                 for k, v in c._asdict().items() if k != "id"}
+                for c in load_category_stats(s)
+            ],
+        }
+    return api_response(s, None, [SITE_SCOPE, HOME_SCOPE], build)
 
 # --- Routes ---
 
@@ -164,155 +1849,128 @@ def home():
     if request.method == "HEAD":
         return ("", 200)
     selected = (request.args.get("category") or "").strip()
-    s = SessionLocal()
+    scopes = [SITE_SCOPE, cat_scope(selected) if selected else HOME_SCOPE]
+    s = get_db()
+    return render_cached(s, selected, scopes, lambda: render_home(s, selected))
+
+def render_home(s, selected):
     settings = get_settings()
-    try:
-        # Dropdown source (to be always available)
-        all_categories = [
-            type('Obj',(object,),{'slug':c.slug,'name':c.name})()
-            for c in s.query(Category).order_by(Category.name).all()
-        ]
-        categories = {}
-        if selected:
-            c = s.query(Category).filter_by(slug=selected).first()
-            if c:
-                rows = (s.query(Ranking)
-                          .filter_by(category_id=c.id)
-                          .order_by(Ranking.total.desc().nullslast())
-                          .all())
-                categories[c.slug] = type("Obj",(object,),{"slug":c.slug,"name":c.name,"rows":rows})()
-        else:
-            for c in s.query(Category).order_by(Category.name).all():
-                rows = (s.query(Ranking)
-                          .filter_by(category_id=c.id)
-                          .order_by(Ranking.total.desc().nullslast())
-                          .all())
-                categories[c.slug] = type("Obj",(object,),{"slug":c.slug,"name":c.name,"rows":rows})()
-    finally:
-        s.close()
+    # Dropdown source (to be always available)
+    cats = all_categories = load_categories(s)
+    categories = {}
+    if selected:
+        cats = [c for c in cats if c.slug == selected]
+    rows_by_cat = {c.id: [] for c in cats}
+    if cats:
+        for r in top_rankings(s, list(rows_by_cat), HOME_TOP_N):
+            rows_by_cat[r.category_id].append(r)
+    for c in cats:
+        categories[c.slug] = CategorySection(c.slug, c.name, rows_by_cat[c.id])
     return render_template("home.html", settings=settings, categories=categories, selected=selected, all_categories=all_categories)
 
 @app.route("/category/<slug>")
 def category_page(slug):
-    s = SessionLocal()
+    s = get_db()
+    scopes = [SITE_SCOPE, cat_scope(slug)]
+    if request.args.get("all"):
+        return render_cached(s, slug, scopes, lambda: stream_category(s, slug), store=False)
+    return render_cached(s, slug, scopes, lambda: render_category(s, slug))
+
+def render_category(s, slug):
     settings = get_settings()
-    try:
-        cat = s.query(Category).filter_by(slug=slug).first()
-        rows = s.query(Ranking).filter_by(category_id=cat.id).order_by(Ranking.id).all() if cat else []
-    finally:
-        s.close()
-    return render_template("category.html", settings=settings, cat=cat, rows=rows)
+    cat = find_category(s, slug)
+    limit = page_limit(request.args.get("limit"))
+    after = decode_cursor(request.args.get("after", ""), RANK_CURSOR)
+    rows, next_cursor = [], None
+    if cat:
+        t = Ranking.__table__
+        stmt = ranking_view_select().where(t.c.category_id == cat.id)
+        if after:
+            stmt = stmt.where(after_rank(t, after))
+        rows = [ranking_view(r) for r in s.execute(stmt.order_by(*rank_order(t)).limit(limit + 1))]
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1].rank, rows[-1].id)
+    return render_template("category.html", settings=settings, cat=cat, rows=rows, has_rows=bool(rows),
+                           first_page=not after, next_cursor=next_cursor, limit=limit, full_table=False)
+
+def stream_category(s, slug):
+    # Whole category, rendered and sent in STREAM_CHUNK_BYTES pieces while rows are fetched in
+    # batches, so memory and time to first byte don't grow with the category.
+    settings = get_settings()
+    cat = find_category(s, slug)
+    rows = []
+    has_rows = False
+    if cat:
+        t = Ranking.__table__
+        has_rows = s.execute(select(t.c.id).where(t.c.category_id == cat.id).limit(1)).first() is not None
+        stmt = (ranking_view_select().where(t.c.category_id == cat.id).order_by(*rank_order(t))
+                  .execution_options(yield_per=STREAM_FETCH_ROWS))
+        rows = (ranking_view(r) for r in s.execute(stmt))
+    pieces = stream_template("category.html", settings=settings, cat=cat, rows=rows, has_rows=has_rows,
+                             first_page=True, next_cursor=None, limit=None, full_table=True)
+    return app.response_class(buffered(pieces, STREAM_CHUNK_BYTES), mimetype="text/html")
 
 
 @app.route("/upload", methods=["GET","POST"])
 def upload():
-    settings = get_settings()
     if request.method == "POST":
         pwd = request.form.get("password","").strip()
         if pwd != UPLOAD_PASSWORD:
             flash("Incorrect password.", "error")
             return redirect(url_for("upload"))
-        # category resolution
-        cat_slug = request.form.get("category_slug","").strip()
-        cat_name = request.form.get("category_name","").strip()
-        if not cat_slug and not cat_name:
-            flash("Please select or enter a category.", "error")
+        file = request.files.get("file")
+        if not file or file.filename == "":
+            flash("Please choose a CSV, XLSX or ZIP file.", "error")
             return redirect(url_for("upload"))
-        s = SessionLocal()
-        try:
+        kind = upload_kind(file.filename)
+        if kind is None:
+            flash("Unsupported file type. Use CSV, XLSX or ZIP.", "error")
+            return redirect(url_for("upload"))
+        mode = "replace" if request.form.get("mode") == "replace" else "append"
+        s = get_db()
+        cat = None
+        if kind != "zip":  # ZIP members pick their category from their file name
+            # category resolution
+            cat_slug = request.form.get("category_slug","").strip()
+            cat_name = request.form.get("category_name","").strip()
+            if not cat_slug and not cat_name:
+                flash("Please select or enter a category.", "error")
+                return redirect(url_for("upload"))
             if cat_slug:
                 cat = s.query(Category).filter_by(slug=cat_slug).first()
                 if not cat:
                     flash("Category not found.", "error")
                     return redirect(url_for("upload"))
             else:
-                slug = slugify(cat_name)
-                cat = s.query(Category).filter_by(slug=slug).first()
-                if not cat:
-                    cat = Category(slug=slug, name=cat_name)
-                    s.add(cat); s.commit(); s.refresh(cat)
+                cat = get_or_create_category(s, cat_name)
 
-            file = request.files.get("file")
-            if not file or file.filename == "":
-                flash("Please choose a CSV or XLSX file.", "error")
-                return redirect(url_for("upload"))
-
-            name = file.filename.lower()
-            count = 0
-            if name.endswith(".csv"):
-                data = io.StringIO(file.stream.read().decode("utf-8"))
-                reader = csv.DictReader(data)
-                fields = [ (h or '').strip() for h in (reader.fieldnames or []) ]
-                missing = [h for h in REQUIRED_HEADERS if h not in fields]
-                if missing:
-                    flash("Missing required columns: " + ", ".join(missing), "error")
-                    return redirect(url_for("category_page", slug=cat.slug))
-                for r in reader:
-                    s.add(Ranking(
-                        category_id=cat.id,
-                        position=str(r.get("POSITION") or ""),
-                        competitor=str(r.get("COMPETITOR") or ""),
-                        club=str(r.get("CLUB") or ""),
-                        execution=to_num(r.get("EXECUTION")),
-                        artistry=to_num(r.get("ARTISTRY")),
-                        difficulty=to_num(r.get("DIFFICULTY")),
-                        line_penalty=to_num(r.get("LINE PENALTY")),
-                        chair_penalty=to_num(r.get("CHAIR PENALTY")),
-                        diff_penalty=to_num(r.get("DIFF PENALTY")),
-                        total=to_num(r.get("TOTAL"))
-                    )); count += 1
-            elif name.endswith(".xlsx"):
-                import openpyxl
-                wb = openpyxl.load_workbook(file, data_only=True)
-                ws = wb.active
-                headers = [str((c.value or "")).strip() for c in ws[1]]
-                missing = [h for h in REQUIRED_HEADERS if h not in headers]
-                if missing:
-                    flash("Missing required columns: " + ", ".join(missing), "error")
-                    return redirect(url_for("category_page", slug=cat.slug))
-                idx = {h:i for i,h in enumerate(headers)}
-                def g(row, key):
-                    return row[idx[key]].value if key in idx else None
-                for row in ws.iter_rows(min_row=2, values_only=False):
-                    s.add(Ranking(
-                        category_id=cat.id,
-                        position=str(g(row,"POSITION") or ""),
-                        competitor=str(g(row,"COMPETITOR") or ""),
-                        club=str(g(row,"CLUB") or ""),
-                        execution=to_num(g(row,"EXECUTION")),
-                        artistry=to_num(g(row,"ARTISTRY")),
-                        difficulty=to_num(g(row,"DIFFICULTY")),
-                        line_penalty=to_num(g(row,"LINE PENALTY")),
-                        chair_penalty=to_num(g(row,"CHAIR PENALTY")),
-                        diff_penalty=to_num(g(row,"DIFF PENALTY")),
-                        total=to_num(g(row,"TOTAL"))
-                    )); count += 1
-            else:
-                flash("Unsupported file type. Use CSV or XLSX.", "error")
-                return redirect(url_for("category_page", slug=cat.slug))
+        job_id = submit_ingest(s, file, kind, cat.slug if cat else None, mode)
+        if job_id is None:
+            flash("Too many uploads are being processed. Try again in a minute.", "error")
+            return redirect(url_for("upload"))
+        return redirect(url_for("upload_job", job_id=job_id))
+    return render_template("upload.html", settings=get_settings())
 
-            s.commit()
-            flash(f"Uploaded {{count}} rows into '{{cat.name}}'.", "success")
-            return redirect(url_for("category_page", slug=cat.slug))
-        finally:
-            s.close()
-    return render_template("upload.html", settings=settings)
+@app.route("/upload/jobs/<job_id>")
+def upload_job(job_id):
+    job = job_status(get_db(), job_id)
+    if job is None:
+        flash("Upload job not found.", "error")
+        return redirect(url_for("upload"))
+    return render_template("job.html", settings=get_settings(), job=job)
 
+@app.route("/api/jobs/<job_id>")
+def api_job(job_id):
+    job = job_status(get_db(), job_id)
+    if job is None:
+        return api_error("job not found", 404)
+    return jsonify(job)
 
 
 @app.route("/settings", methods=["GET","POST"])
 def settings_page():
-    settings = get_settings()
-    s = SessionLocal()
-    try:
-        cats = s.query(Category).order_by(Category.name).all()
-        # compute counts per category
-        counts = {}
-        for c in cats:
-            counts[c.slug] = s.query(Ranking).filter_by(category_id=c.id).count()
-    finally:
-        s.close()
-
+    s = get_db()
     if request.method == "POST":
         pwd = request.form.get("password","").strip()
         if pwd != UPLOAD_PASSWORD:
@@ -321,26 +1979,26 @@ def settings_page():
 
         action = request.form.get("action","save_settings")
         if action == "save_settings":
-            set_setting("title", request.form.get("title","").strip())
-            set_setting("subtitle", request.form.get("subtitle","").strip())
-            set_setting("event_date", request.form.get("event_date","").strip())
-            set_setting("location", request.form.get("location","").strip())
+            set_settings({
+                key: request.form.get(key,"").strip()
+                for key in ("title", "subtitle", "event_date", "location")
+            })
             flash("Settings saved.", "success")
 
         elif action == "add_cat":
             name = request.form.get("new_category","").strip()
             if name:
-                s = SessionLocal()
-                try:
-                    slug = slugify(name)
-                    if not s.query(Category).filter_by(slug=slug).first():
-                        s.add(Category(slug=slug, name=name)); s.commit()
-                        flash(f"Added category '{name}'.", "success")
-                    else:
-                        flash("Category already exists.", "error")
-                finally:
-                    s.close()
+                slug = slugify(name)
+                if not s.query(Category).filter_by(slug=slug).first():
+                    s.add(Category(slug=slug, name=name)); site_changed(s); s.commit()
+                    flash(f"Added category '{name}'.", "success")
+                else:
+                    flash("Category already exists.", "error")
         return redirect(url_for("settings_page"))
+
+    settings = get_settings()
+    cats = load_category_stats(s)
+    counts = {c.slug: c.entries for c in cats}
     return render_template("settings.html", settings=settings, cats=cats, cat_counts=counts)
 
 @app.route("/privacy")
@@ -351,8 +2009,131 @@ def privacy():
 def terms():
     return render_template("terms.html", settings=get_settings())
 
-if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=int(os.environ.get("PORT","5000")), debug=True)
+# --- CLI & health checks ---
+# Schema and seed data are set up once per deploy (`flask --app app init-db`), never in workers.
+def init_db():
+    applied = migrate(get_engine())
+    seed_if_empty()
+    sweep_ingest()
+    return applied
+
+@app.cli.command("migrate")
+def migrate_command():
+    """Apply pending schema migrations."""
+    applied = migrate(get_engine())
+    print("Applied migrations: " + (", ".join(map(str, applied)) or "none"))
+
+@app.cli.command("init-db")
+def init_db_command():
+    """Apply pending migrations and seed default categories and settings."""
+    applied = init_db()
+    print("Applied migrations: " + (", ".join(map(str, applied)) or "none") + "; seed done.")
+
+# --- Static assets ---
+# `flask build-assets` copies static files to static/dist/ under content-hashed names and
+# writes static/dist/manifest.json; url_for('static', filename=...) then points at the hashed
+# copy, which is served with a one-year immutable Cache-Control.
+STATIC_DIST = "dist"
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+def load_asset_manifest():
+    path = os.path.join(app.static_folder, STATIC_DIST, "manifest.json")
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+asset_manifest = load_asset_manifest()
+
+def load_build_token():
+    # Part of every page ETag, so a deploy (new templates, code or asset names) never gets a
+    # 304 for HTML rendered by the previous build. Render sets RENDER_GIT_COMMIT.
+    h = hashlib.sha256((os.environ.get("RENDER_GIT_COMMIT") or os.environ.get("BUILD_ID") or "").encode())
+    h.update(json.dumps(asset_manifest, sort_keys=True).encode())
+    sources = [os.path.abspath(__file__)]
+    for dirpath, dirnames, filenames in os.walk(os.path.join(app.root_path, app.template_folder)):
+        dirnames.sort()
+        sources += [os.path.join(dirpath, name) for name in sorted(filenames)]
+    for path in sources:
+        with open(path, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()[:10]
+
+BUILD_TOKEN = load_build_token()
+# pages are never older than the process serving them: If-Modified-Since from before a
+# restart/deploy gets a full response
+BUILD_STARTED = datetime.now(timezone.utc)
+
+@app.url_defaults
+def hashed_static_url(endpoint, values):
+    if endpoint == "static" and values.get("filename") in asset_manifest:
+        values["filename"] = asset_manifest[values["filename"]]
+
+@app.after_request
+def immutable_assets(resp):
+    if request.endpoint == "static" and resp.status_code == 200 \
+            and (request.view_args or {}).get("filename", "").startswith(STATIC_DIST + "/"):
+        resp.cache_control.no_cache = None
+        resp.cache_control.public = True
+        resp.cache_control.max_age = ASSET_MAX_AGE
+        resp.cache_control.immutable = True
+    return resp
+
+@app.cli.command("build-assets")
+def build_assets_command():
+    """Copy static files to static/dist under content-hashed names."""
+    root = app.static_folder
+    dist = os.path.join(root, STATIC_DIST)
+    shutil.rmtree(dist, ignore_errors=True)
+    os.makedirs(dist)
+    manifest = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        if os.path.abspath(dirpath) == os.path.abspath(root) and STATIC_DIST in dirnames:
+            dirnames.remove(STATIC_DIST)
+        for name in sorted(filenames):
+            src = os.path.join(dirpath, name)
+            rel = os.path.relpath(src, root).replace(os.sep, "/")
+            with open(src, "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()[:12]
+            stem, ext = os.path.splitext(rel)
+            hashed = f"{STATIC_DIST}/{stem}.{digest}{ext}"
+            os.makedirs(os.path.dirname(os.path.join(root, hashed)), exist_ok=True)
+            shutil.copyfile(src, os.path.join(root, hashed))
+            manifest[rel] = hashed
+    with open(os.path.join(dist, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    print(f"Built {len(manifest)} assets into {dist}")
+
+@app.route("/healthz")
+def healthz():
+    # Liveness: the worker is up. Never touches the database.
+    return ("ok", 200, {"Content-Type": "text/plain", "Cache-Control": "no-store"})
+
+@app.route("/readyz")
+def readyz():
+    # Readiness: the database answers and the schema is at the latest migration.
+    expected = MIGRATIONS[-1][0]
+    try:
+        with get_engine().connect() as conn:
+            current = conn.execute(select(func.max(SchemaMigration.version))).scalar()
+    except Exception as e:
+        app.logger.warning("readiness check failed: %s", e)
+        return ("database unavailable", 503, {"Content-Type": "text/plain", "Cache-Control": "no-store"})
+    if current != expected:
+        return (f"schema at {current}, expected {expected}", 503, {"Content-Type": "text/plain", "Cache-Control": "no-store"})
+    return ("ready", 200, {"Content-Type": "text/plain", "Cache-Control": "no-store"})
+
+@app.route("/metrics")
+def metrics_endpoint():
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return ("unauthorized", 401, {"Content-Type": "text/plain", "Cache-Control": "no-store"})
+    gauges = [("gym_page_cache_bytes", page_cache.size)]
+    pool = _engine.pool if _engine is not None else None
+    if hasattr(pool, "checkedout"):
+        gauges += [("gym_db_pool_checked_out", pool.checkedout()), ("gym_db_pool_size", pool.size())]
+    return (metrics.render(gauges), 200,
+            {"Content-Type": "text/plain; version=0.0.4", "Cache-Control": "no-store"})
 
 
 @app.before_request
@@ -367,17 +2148,16 @@ def delete_category_data(slug):
     if pwd != UPLOAD_PASSWORD:
         flash("Parola incorecta.", "error")
         return redirect(url_for("category_page", slug=slug))
-    s = SessionLocal()
-    try:
-        cat = s.query(Category).filter_by(slug=slug).first()
-        if not cat:
-            flash("Categoria nu exista.", "error")
-            return redirect(url_for("home"))
-        deleted = s.query(Ranking).filter_by(category_id=cat.id).delete()
-        s.commit()
-        flash(f"Sters {deleted} randuri pentru categoria '{cat.name}'.", "success")
-    finally:
-        s.close()
+    s = get_db()
+    cat = s.query(Category).filter_by(slug=slug).first()
+    if not cat:
+        flash("Categoria nu exista.", "error")
+        return redirect(url_for("home"))
+    deleted = s.query(Ranking).filter_by(category_id=cat.id).delete()
+    refresh_stats(s, cat.id)
+    data_changed(s, cat.slug)
+    s.commit()
+    flash(f"Sters {deleted} randuri pentru categoria '{cat.name}'.", "success")
     return redirect(url_for("category_page", slug=slug))
 
 
@@ -392,17 +2172,16 @@ def delete_by_name():
         flash("Completeaza numele categoriei.", "error")
         return redirect(url_for("upload"))
     slug = slugify(name)
-    s = SessionLocal()
-    try:
-        cat = s.query(Category).filter_by(slug=slug).first()
-        if not cat:
-            flash("Categoria nu exista.", "error")
-            return redirect(url_for("upload"))
-        deleted = s.query(Ranking).filter_by(category_id=cat.id).delete()
-        s.commit()
-        flash(f"Sters {deleted} randuri pentru categoria '{cat.name}'.", "success")
-    finally:
-        s.close()
+    s = get_db()
+    cat = s.query(Category).filter_by(slug=slug).first()
+    if not cat:
+        flash("Categoria nu exista.", "error")
+        return redirect(url_for("upload"))
+    deleted = s.query(Ranking).filter_by(category_id=cat.id).delete()
+    refresh_stats(s, cat.id)
+    data_changed(s, cat.slug)
+    s.commit()
+    flash(f"Sters {deleted} randuri pentru categoria '{cat.name}'.", "success")
     return redirect(url_for("category_page", slug=slug))
 
 
@@ -412,21 +2191,20 @@ def delete_category(slug):
     if pwd != UPLOAD_PASSWORD:
         flash("Parola incorecta.", "error")
         return redirect(url_for("category_page", slug=slug))
-    s = SessionLocal()
-    try:
-        cat = s.query(Category).filter_by(slug=slug).first()
-        if not cat:
-            flash("Categoria nu exista.", "error")
-            return redirect(url_for("home"))
-        # sterge randurile
-        s.query(Ranking).filter_by(category_id=cat.id).delete()
-        # sterge categoria
-        name = cat.name
-        s.delete(cat)
-        s.commit()
-        flash(f"Categoria '{name}' a fost stearsa complet.", "success")
-    finally:
-        s.close()
+    s = get_db()
+    cat = s.query(Category).filter_by(slug=slug).first()
+    if not cat:
+        flash("Categoria nu exista.", "error")
+        return redirect(url_for("home"))
+    # sterge randurile
+    s.query(Ranking).filter_by(category_id=cat.id).delete()
+    refresh_stats(s, cat.id)
+    # sterge categoria
+    name = cat.name
+    s.delete(cat)
+    data_changed(s, cat.slug); site_changed(s)
+    s.commit()
+    flash(f"Categoria '{name}' a fost stearsa complet.", "success")
     return redirect(url_for("home"))
 
 
@@ -437,18 +2215,18 @@ def settings_delete_category():
         flash("Parola incorecta.", "error")
         return redirect(url_for("settings_page"))
     slug = request.form.get("slug","").strip()
-    s = SessionLocal()
-    try:
-        cat = s.query(Category).filter_by(slug=slug).first()
-        if not cat:
-            flash("Categoria nu exista.", "error")
-            return redirect(url_for("settings_page"))
-        s.query(Ranking).filter_by(category_id=cat.id).delete()
-        name = cat.name
-        s.delete(cat); s.commit()
-        flash(f"Categoria '{name}' a fost stearsa complet.", "success")
-    finally:
-        s.close()
+    s = get_db()
+    cat = s.query(Category).filter_by(slug=slug).first()
+    if not cat:
+        flash("Categoria nu exista.", "error")
+        return redirect(url_for("settings_page"))
+    s.query(Ranking).filter_by(category_id=cat.id).delete()
+    refresh_stats(s, cat.id)
+    name = cat.name
+    s.delete(cat)
+    data_changed(s, cat.slug); site_changed(s)
+    s.commit()
+    flash(f"Categoria '{name}' a fost stearsa complet.", "success")
     return redirect(url_for("settings_page"))
 
 @app.route("/settings/category/rename", methods=["POST"])
@@ -462,29 +2240,25 @@ def settings_rename_category():
     if not new_name:
         flash("Introdu un nume nou.", "error")
         return redirect(url_for("settings_page"))
-    s = SessionLocal()
-    try:
-        cat = s.query(Category).filter_by(slug=slug).first()
-        if not cat:
-            flash("Categoria nu exista.", "error")
-            return redirect(url_for("settings_page"))
-        new_slug = slugify(new_name)
-        # check duplicate
-        if s.query(Category).filter(Category.id != cat.id, Category.slug == new_slug).first():
-            flash("Exista deja o categorie cu acest nume.", "error")
-            return redirect(url_for("settings_page"))
-        cat.name = new_name
-        cat.slug = new_slug
-        s.commit()
-        flash("Categoria a fost redenumita.", "success")
-    finally:
-        s.close()
+    s = get_db()
+    cat = s.query(Category).filter_by(slug=slug).first()
+    if not cat:
+        flash("Categoria nu exista.", "error")
+        return redirect(url_for("settings_page"))
+    new_slug = slugify(new_name)
+    # check duplicate
+    if s.query(Category).filter(Category.id != cat.id, Category.slug == new_slug).first():
+        flash("Exista deja o categorie cu acest nume.", "error")
+        return redirect(url_for("settings_page"))
+    data_changed(s, cat.slug, new_slug); site_changed(s)
+    cat.name = new_name
+    cat.slug = new_slug
+    s.commit()
+    flash("Categoria a fost redenumita.", "success")
     return redirect(url_for("settings_page"))
 
 
 # --- Simple i18n ---
-from flask import make_response, g
-
 I18N = {
     "en": {
         "Upload": "Upload",
@@ -499,6 +2273,7 @@ I18N = {
         "Headers required": "Headers required",
         "Delete file (all rows)": "Delete file (all rows)",
         "Delete CATEGORY (permanent)": "Delete CATEGORY (permanent)",
+        "Replace existing rows": "Replace existing rows",
     },
     "ro": {
         "Upload": "Incarca",
@@ -513,6 +2288,7 @@ I18N = {
         "Headers required": "Header-e necesare",
         "Delete file (all rows)": "Sterge fisierul (toate randurile)",
         "Delete CATEGORY (permanent)": "Sterge CATEGORIA (definitiv)",
+        "Replace existing rows": "Inlocuieste randurile existente",
     },
 }
 
@@ -534,3 +2310,8 @@ def set_lang(code):
     resp = make_response(redirect(nxt))
     resp.set_cookie("lang", code, max_age=60*60*24*365)  # 1 an
     return resp
+
+
+if __name__ == "__main__":
+    init_db()
+    app.run(host="0.0.0.0", port=int(os.environ.get("PORT","5000")), debug=True)
@@ -0,0 +1,274 @@
+"""Benchmark the app on a synthetic season.
+
+    python bench.py                                   # SQLite in a temp dir, defaults below
+    python bench.py --competitors 500 --save-baseline bench_baseline.json
+    python bench.py --compare bench_baseline.json     # diff against an earlier run
+    python bench.py --db postgresql://user:pw@localhost/gym_bench
+
+Uploads every category as CSV and XLSX through /upload (polling /api/jobs until the
+background ingest finishes), then drives the public pages and the settings page through
+the Flask test client. Reports p50/p95/p99 latency, SQL queries per request, peak traced
+memory and ingest rows per second. The database given with --db is wiped.
+"""
+import os, sys, csv, json, time, random, shutil, argparse, tempfile, tracemalloc, platform
+
+WORKDIR = tempfile.mkdtemp(prefix="gym-bench-")
+
+FIRST_NAMES = ["Andrei", "Ana", "Ioana", "Mihai", "Maria", "Stefan", "Elena", "Alexandru", "Daria", "Vlad",
+               "Sofia", "Radu", "Bianca", "Teodora", "Matei", "Irina", "Darius", "Alina", "Luca", "Carla"]
+LAST_NAMES = ["Popescu", "Ionescu", "Georgescu", "Dumitru", "Stan", "Stoica", "Munteanu", "Constantin",
+              "Marin", "Tudor", "Dobre", "Barbu", "Nistor", "Florea", "Ene", "Lazar", "Matei", "Ciobanu"]
+CLUBS = ["CSS Buzau", "CS Dinamo", "CSA Steaua", "CSM Cluj", "CSS Constanta", "CSM Bucuresti", "CS Farul",
+         "CSS Oradea", "LPS Focsani", "CSM Iasi", "CS Rapid", "CSS Deva", "CSM Brasov", "ACS Star Dance"]
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Benchmark Gym Rankings on a synthetic season.")
+    p.add_argument("--db", default="", help="database URL (default: fresh SQLite file in a temp dir)")
+    p.add_argument("--categories", type=int, default=21, help="number of categories (default 21, like DEFAULT_CATS)")
+    p.add_argument("--competitors", type=int, default=200, help="competitors per category (default 200)")
+    p.add_argument("--requests", type=int, default=200, help="requests per page scenario (default 200)")
+    p.add_argument("--memory-requests", type=int, default=20, help="requests per scenario traced for peak memory")
+    p.add_argument("--seed", type=int, default=2025)
+    p.add_argument("--out", default="", help="write this run's results as JSON")
+    p.add_argument("--save-baseline", default="", help="same as --out; kept for readability in scripts")
+    p.add_argument("--compare", default="", help="baseline JSON to diff against")
+    p.add_argument("--fail-over", type=float, default=0,
+                   help="exit 1 when a p95 or queries/request regresses by more than this percent")
+    return p.parse_args()
+
+
+# --- Synthetic season ---
+def category_names(n, defaults):
+    names = []
+    for i in range(n):
+        base = defaults[i % len(defaults)]
+        names.append(base if i < len(defaults) else f"{base} {i // len(defaults) + 1}")
+    return names
+
+def season_rows(rng, n):
+    # REQUIRED_HEADERS order: POSITION, COMPETITOR, CLUB, scores..., TOTAL (consistent with the parts)
+    rows = []
+    for _ in range(n):
+        execution = round(rng.uniform(5, 9.5), 3)
+        artistry = round(rng.uniform(5, 9.5), 3)
+        difficulty = round(rng.uniform(0.5, 3), 3)
+        penalties = [round(rng.choice([0, 0, 0, 0.1, 0.2, 0.3]), 3) for _ in range(3)]
+        total = round(execution + artistry + difficulty - sum(penalties), 3)
+        competitor = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+        rows.append([competitor, rng.choice(CLUBS), execution, artistry, difficulty, *penalties, total])
+    rows.sort(key=lambda r: -r[-1])
+    return [[str(i + 1)] + r for i, r in enumerate(rows)]
+
+def write_csv(path, headers, rows):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(headers)
+        w.writerows(rows)
+
+def write_xlsx(path, headers, rows):
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(headers)
+    for r in rows:
+        ws.append(r)
+    wb.save(path)
+
+
+# --- Measurement ---
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+class QueryCounter:
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine, "after_cursor_execute", self._after)
+
+    def _after(self, *args):
+        self.count += 1
+
+def run_scenario(client, counter, url, n, before=None):
+    timings, queries = [], 0
+    for _ in range(n):
+        if before:
+            before()
+        start_q = counter.count
+        t0 = time.perf_counter()
+        r = client.get(url)
+        r.get_data()  # drain streamed bodies
+        timings.append(time.perf_counter() - t0)
+        queries += counter.count - start_q
+        if r.status_code != 200:
+            raise SystemExit(f"{url} answered {r.status_code}")
+    timings.sort()
+    return {
+        "requests": n,
+        "p50_ms": round(percentile(timings, 50) * 1000, 3),
+        "p95_ms": round(percentile(timings, 95) * 1000, 3),
+        "p99_ms": round(percentile(timings, 99) * 1000, 3),
+        "mean_ms": round(sum(timings) / n * 1000, 3),
+        "queries_per_request": round(queries / n, 2),
+    }
+
+def traced_peak_kb(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+    finally:
+        tracemalloc.stop()
+
+def upload_and_wait(client, appmod, path, cat_name):
+    with open(path, "rb") as f:
+        r = client.post("/upload", data={
+            "password": appmod.UPLOAD_PASSWORD, "category_name": cat_name, "mode": "replace",
+            "file": (f, os.path.basename(path)),
+        }, content_type="multipart/form-data")
+    location = r.headers.get("Location", "")
+    if "/upload/jobs/" not in location:
+        raise SystemExit(f"upload of {path} was rejected (redirected to {location or r.status_code})")
+    job_id = location.rstrip("/").rsplit("/", 1)[1]
+    while True:
+        job = client.get(f"/api/jobs/{job_id}").get_json()
+        if job["finished"]:
+            break
+        time.sleep(0.01)
+    if job["status"] != "done" or job["errors"]:
+        raise SystemExit(f"ingest of {path} failed: {job['errors']}")
+    return job["rows_inserted"]
+
+def run_ingest(client, appmod, files, fmt):
+    total_rows = 0
+    t0 = time.perf_counter()
+    for cat_name, paths in files:
+        total_rows += upload_and_wait(client, appmod, paths[fmt], cat_name)
+    seconds = time.perf_counter() - t0
+    return {"rows": total_rows, "seconds": round(seconds, 3), "rows_per_s": round(total_rows / seconds, 1)}
+
+
+# --- Baseline diff ---
+def compare(results, baseline, fail_over):
+    regressions = []
+    print(f"\nCompared with {baseline.get('meta', {}).get('created', 'baseline')}:")
+    for name, cur in results["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if not old:
+            continue
+        parts = []
+        for key in ("p50_ms", "p95_ms", "p99_ms", "queries_per_request", "peak_kb"):
+            if old.get(key):
+                delta = (cur[key] - old[key]) / old[key] * 100
+                parts.append(f"{key} {delta:+.1f}%")
+                if fail_over and key in ("p95_ms", "queries_per_request") and delta > fail_over:
+                    regressions.append(f"{name} {key} {delta:+.1f}%")
+        print(f"  {name:<22} " + "  ".join(parts))
+    for fmt, cur in results["ingest"].items():
+        old = baseline.get("ingest", {}).get(fmt)
+        if old and old.get("rows_per_s"):
+            delta = (cur["rows_per_s"] - old["rows_per_s"]) / old["rows_per_s"] * 100
+            print(f"  ingest {fmt:<15} rows_per_s {delta:+.1f}%")
+            if fail_over and -delta > fail_over:
+                regressions.append(f"ingest {fmt} rows_per_s {delta:+.1f}%")
+    return regressions
+
+
+def main():
+    args = parse_args()
+    db_url = args.db or "sqlite:///" + os.path.join(WORKDIR, "bench.db")
+    os.environ["DATABASE_URL"] = db_url
+    os.environ.setdefault("UPLOAD_PASSWORD", "bench")
+    os.environ.setdefault("INGEST_SPOOL_DIR", os.path.join(WORKDIR, "spool"))
+    os.environ["SLOW_REQUEST_MS"] = "0"
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as appmod
+
+    engine = appmod.get_engine()
+    appmod.Base.metadata.drop_all(engine)
+    with engine.begin() as conn:
+        for stmt in ("DROP TABLE IF EXISTS rankings_fts", "DROP TABLE IF EXISTS schema_migrations"):
+            conn.exec_driver_sql(stmt)
+    appmod.init_db()
+    client = appmod.app.test_client()
+    counter = QueryCounter(engine)
+
+    rng = random.Random(args.seed)
+    names = category_names(args.categories, appmod.DEFAULT_CATS)
+    files = []
+    for i, name in enumerate(names):
+        rows = season_rows(rng, args.competitors)
+        paths = {"csv": os.path.join(WORKDIR, f"cat{i}.csv"), "xlsx": os.path.join(WORKDIR, f"cat{i}.xlsx")}
+        write_csv(paths["csv"], appmod.REQUIRED_HEADERS, rows)
+        write_xlsx(paths["xlsx"], appmod.REQUIRED_HEADERS, rows)
+        files.append((name, paths))
+
+    results = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "db": engine.dialect.name,
+            "python": platform.python_version(),
+            "categories": args.categories,
+            "competitors": args.competitors,
+            "requests": args.requests,
+            "seed": args.seed,
+        },
+        "ingest": {},
+        "scenarios": {},
+    }
+
+    # replace mode: every format loads the same season from scratch
+    for fmt in ("csv", "xlsx"):
+        stats = {}
+        stats["peak_kb"] = traced_peak_kb(lambda: stats.update(run_ingest(client, appmod, files[:1], fmt)))
+        stats.update(run_ingest(client, appmod, files, fmt))
+        results["ingest"][fmt] = stats
+
+    slug = appmod.slugify(names[0])
+    cold = appmod.page_cache.clear
+    scenarios = [
+        ("home", "/", None),
+        ("home:cold", "/", cold),
+        ("home:category", f"/?category={slug}", None),
+        ("category", f"/category/{slug}", None),
+        ("category:cold", f"/category/{slug}", cold),
+        ("category:all", f"/category/{slug}?all=1", None),
+        ("settings", "/settings", None),
+    ]
+    for name, url, before in scenarios:
+        run_scenario(client, counter, url, 3, before)  # warm up
+        stats = run_scenario(client, counter, url, args.requests, before)
+        stats["peak_kb"] = traced_peak_kb(lambda: run_scenario(client, counter, url, args.memory_requests, before))
+        results["scenarios"][name] = stats
+
+    print(f"{results['meta']['db']}: {args.categories} categories x {args.competitors} competitors, "
+          f"{args.requests} requests per scenario")
+    print(f"{'scenario':<22}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>10}{'peak KB':>11}")
+    for name, st in results["scenarios"].items():
+        print(f"{name:<22}{st['p50_ms']:>10.2f}{st['p95_ms']:>10.2f}{st['p99_ms']:>10.2f}"
+              f"{st['queries_per_request']:>10.2f}{st['peak_kb']:>11.1f}")
+    for fmt, st in results["ingest"].items():
+        print(f"ingest {fmt:<15}{st['rows']:>8} rows {st['seconds']:>8.2f}s {st['rows_per_s']:>10.1f} rows/s"
+              f"  peak {st['peak_kb']:.1f} KB (one file)")
+
+    for path in filter(None, (args.out, args.save_baseline)):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"saved {path}")
+
+    engine.dispose()
+    shutil.rmtree(WORKDIR, ignore_errors=True)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.fail_over)
+        if regressions:
+            print("regressions over %.1f%%: %s" % (args.fail_over, ", ".join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
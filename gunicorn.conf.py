@@ -0,0 +1,6 @@
+# Loaded automatically by `gunicorn app:app`. app.pool_settings() reads the same variables,
+# so the SQLAlchemy pool always matches the number of request threads per worker.
+import os
+
+workers = int(os.environ.get("WEB_CONCURRENCY", "1"))
+threads = int(os.environ.get("GUNICORN_THREADS", "1"))